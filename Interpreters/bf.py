@@ -1,10 +1,118 @@
-from sys import stdout, argv
+"""
+    bf.py
+    Brainfuck interpreter, usable as a script or imported as a library:
+
+        import bf
+        program = bf.compile(source)
+        output = program.run(b"input", max_steps=10 ** 6)
+
+    A Program holds no run state, so one compiled program can be run any
+    number of times, from any number of threads.
+"""
+
+import argparse
+import builtins
+import json
+import ctypes
+import marshal
+import mmap
+import shlex
+import signal
+import struct
+import subprocess
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from hashlib import sha256
+from io import BytesIO
+from os import environ, getpid, makedirs, path, remove, replace
+from re import compile as regex
+from sys import stdin, stdout, stderr, implementation
+from tempfile import TemporaryDirectory
+from time import monotonic, perf_counter
+
+# Opcodes of the compiled program. A program is a flat list of alternating
+# opcodes and operands, so instruction i lives at code[2 * i : 2 * i + 2].
+# Loop brackets store the code index of their partner as the operand, ZERO,
+# OUT and IN take the offset of the cell they touch relative to the pointer.
+# Operands that don't fit in one int (ADDAT, MUL) index into a constant table.
+ADD, MOVE, ZERO, OUT, OPEN, CLOSE, ADDAT, MUL, SCAN, IN = range(10)
+OPCODES = ("ADD", "MOVE", "ZERO", "OUT", "OPEN", "CLOSE", "ADDAT", "MUL",
+           "SCAN", "IN")
+
+# Step budget of a run without max_steps
+UNLIMITED = float("inf")
+
+# Steps between clock checks when a run has a timeout
+CLOCK_INTERVAL = 1 << 16
+
+# Loop memoization: cached loop results, widest window of cells a loop may
+# touch and fewest steps a loop run must take to be worth caching
+MEMO_SIZE = 1 << 12
+MEMO_WIDTH = 64
+MEMO_STEPS = 64
+
+# Deepest loop nesting the JIT renders, CPython refuses to compile more than
+# 20 statically nested blocks
+JIT_DEPTH = 20
+
+# Bump whenever generated JIT code changes shape so stale cache entries miss
+JIT_VERSION = 4
+NATIVE_VERSION = 3
+BFC_VERSION = 2
+
+# Header of a .bfc file: magic, format version, byte order of the records,
+# hash of source and passes, reaches, then the lengths of the source path,
+# code, constant and offset tables. The header is padded to BFC_ALIGN bytes
+# and each table starts BFC_ALIGN aligned, holding native 32-bit ints.
+BFC_MAGIC = b"BFC\0"
+BFC_HEADER = struct.Struct("<4sIc32siiIQQQ")
+BFC_ALIGN = 16
+
+# Header of a checkpoint: magic, format version, byte order of the cells,
+# program key, the code index and step count to continue from, pointer,
+# origin, cell bits, grow, tape size, output bytes written, input bytes
+# consumed. The cells follow, zlib compressed.
+SNAPSHOT_MAGIC = b"BFS\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sIc32sQQqqBBQQQ")
+
+# Runs of arithmetic or movement are matched as a whole and folded into one
+# instruction, everything that isn't a bf command is skipped over
+TOKENS = regex(r"[+\-]+|[<>]+|[.,\[\]]")
+
 
 class BFTape:
-    def __init__(self, size):
-        self.tapeRoll = [0] * size
+    """Cells of 8, 16 or 32 bits packed into a bytearray or array.
+
+    Arithmetic wraps around at the cell width. A fixed tape raises IndexError
+    when the pointer leaves it, a growing tape extends itself in whichever
+    direction the pointer runs off. pointer indexes tapeRoll directly, cells
+    before origin are padding or growth to the left of the starting cell.
+    """
+    def __init__(self, size=30000, bits=8, grow=False):
+        if bits == 8:
+            self.tapeRoll = bytearray(size)
+        elif bits in (16, 32):
+            typecode = next(code for code in "HIL"
+                            if array(code).itemsize * 8 == bits)
+            self.tapeRoll = array(typecode, bytes(size * bits // 8))
+        else:
+            raise ValueError("Cells must be 8, 16 or 32 bits wide")
+        self.mask = (1 << bits) - 1
+        self.size = size
+        self.grow = grow
+        self.origin = 0
         self.pointer = 0
 
+    def _zeros(self, count):
+        cells = self.tapeRoll
+        if isinstance(cells, bytearray):
+            return bytes(count)
+        return array(cells.typecode, bytes(count * cells.itemsize))
+
     def getCurrent(self):
         return self.tapeRoll[self.pointer]
 
@@ -12,111 +120,1493 @@ class BFTape:
         self.tapeRoll[self.pointer] = 0
 
     def add(self, c):
-        self.tapeRoll[self.pointer] += c
+        self.tapeRoll[self.pointer] = (self.tapeRoll[self.pointer] + c) \
+            & self.mask
 
     def sub(self, c):
-        self.tapeRoll[self.pointer] -= c
+        self.add(-c)
 
     def left(self, c):
-        self.pointer -= c
+        self.pointer = self.reach(self.pointer - c)
 
     def right(self, c):
-        self.pointer += c
+        self.pointer = self.reach(self.pointer + c)
+
+    def reach(self, pointer, margin=0):
+        """Makes pointer and margin cells either side of it addressable.
+
+        Returns the pointer, which shifts along with the cells whenever the
+        tape has to grow to the left. tapeRoll is always resized in place.
+        """
+        cells = self.tapeRoll
+        if not self.grow and not \
+                self.origin <= pointer < self.origin + self.size:
+            raise IndexError("Pointer moved off the tape to cell {}"
+                             .format(pointer - self.origin))
+        if pointer < margin:
+            # Grows geometrically so walking left stays amortized linear
+            shift = max(margin - pointer, len(cells) if self.grow else 0)
+            cells[0:0] = self._zeros(shift)
+            self.origin += shift
+            pointer += shift
+        if pointer + margin >= len(cells):
+            cells.extend(self._zeros(max(pointer + margin + 1 - len(cells),
+                                         len(cells) if self.grow else 0)))
+        return pointer
 
-    def out(self):
-        stdout.write(chr(self.tapeRoll[self.pointer]))
-        stdout.flush()
+    def zone(self, pointer, below, above):
+        """Returns the range pointer can move in without a closer look.
 
-class BFFile:
+        Within it every cell from below cells under the pointer to above
+        cells over it is addressable. Near the ends of a fixed tape the
+        range is empty, so that each move is checked.
+        """
+        if self.grow:
+            return below, len(self.tapeRoll) - above
+        low = self.origin + below
+        high = self.origin + self.size - above
+        return (low, high) if low <= pointer < high else (0, 0)
+
+    def check(self, pointer, span):
+        """Raises IndexError if a fixed tape lacks any cell from pointer +
+        span[0] to pointer + span[1]"""
+        if self.grow:
+            return
+        for cell in (pointer + span[0], pointer + span[1]):
+            if not self.origin <= cell < self.origin + self.size:
+                raise IndexError("Pointer moved off the tape to cell {}"
+                                 .format(cell - self.origin))
+
+    def scan(self, pointer, step):
+        """Returns the first zero cell from pointer on in steps of step.
+
+        Single steps search in C with find/rfind (or array.index), if no zero
+        is found the result lies just off the tape for reach to deal with.
+        """
+        cells = self.tapeRoll
+        if step == 1:
+            if isinstance(cells, bytearray):
+                found = cells.find(0, pointer)
+                return found if found != -1 else len(cells)
+            try:
+                return cells.index(0, pointer)
+            except ValueError:
+                return len(cells)
+        if step == -1 and isinstance(cells, bytearray):
+            return cells.rfind(0, 0, pointer + 1)
+        while 0 <= pointer < len(cells) and cells[pointer]:
+            pointer += step
+        return pointer
+
+
+class StepLimitExceeded(RuntimeError):
+    """Raised when a run executes more instructions than max_steps allows.
+
+    output holds whatever the program wrote before it was stopped, when
+    the run collected it.
+    """
+    def __init__(self, steps, output=None):
+        super().__init__("Program exceeded its budget of {} steps"
+                         .format(steps))
+        self.steps = steps
+        self.output = output
+
+
+class TimeLimitExceeded(RuntimeError):
+    """Raised when a run is still going after its timeout, see
+    StepLimitExceeded for output"""
+    def __init__(self, timeout, output=None):
+        super().__init__("Program exceeded its timeout of {} seconds"
+                         .format(timeout))
+        self.timeout = timeout
+        self.output = output
+
+
+class Checkpointed(RuntimeError):
+    """Raised when a run stops after saving a checkpoint it was asked for"""
     def __init__(self, file):
-        with open(file) as input:
-            self.inputFile = input.read().replace("[-]", "!")
-        self.length = len(self.inputFile)
-        self.indexes = [1] * self.length
-        self.pointer = 0
-        self.concatFile()
-
-    def _count(self, begin):
-        for index in range(begin, self.length):
-            if self.inputFile[index] != self.inputFile[begin]:
-                return index - begin
-        return self.length - begin
-
-    def _find_end(self, begin):
-        index = begin + 1
-        while index < self.length:
-            if self.inputFile[index] == ']':
-                return index - begin
-            elif self.inputFile[index] == '[':
-                index += self._find_end(index)
-            index += 1
-
-    def concatFile(self):
-        for index in range(self.length):
-            if self.inputFile[index] == '[':
-                self.indexes[index] = self._find_end(index)
-                self.indexes[index + self.indexes[index]] = self.indexes[index]
-            elif self.inputFile[index] in ['+', '-', '<', '>']:
-                self.indexes[index] = self._count(index)
-
-    def getChar(self):
-        return self.inputFile[self.pointer]
-
-    def movePointer(self, distance):
-        self.pointer += distance
-
-    def getOffset(self):
-        return self.indexes[self.pointer]
-
-    def isEnd(self):
-        return self.pointer == self.length
+        super().__init__("Checkpoint saved to {}".format(file))
+        self.file = file
 
-if __name__ == "__main__":
-    if (len(argv) == 0):
-        print("Usage: {} filename.b".format(argv[0]))
-        exit()
 
-    file = BFFile(argv[1])
-    tape = BFTape(30000)
+class BFOutput:
+    """Collects output bytes and passes them on to a binary stream.
+
+    flush decides when buffered bytes are written out: "newline" after every
+    line, "size" whenever size bytes have piled up and "exit" only when
+    flush() is called at the end of the run. stream can be any binary file
+    object, an io.BytesIO keeps the output in memory.
+    """
+    def __init__(self, stream=None, flush="size", size=1 << 16):
+        if flush not in ("newline", "size", "exit"):
+            raise ValueError("Unknown flush policy {!r}".format(flush))
+        self.stream = stream if stream is not None else stdout.buffer
+        self.policy = flush
+        self.size = size
+        self.buffer = bytearray()
+        self.written = 0
+
+    def write(self, value):
+        self.buffer.append(value & 0xFF)
+        if self.policy == "newline":
+            if value & 0xFF == 10:
+                self.flush()
+        elif self.policy == "size" and len(self.buffer) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(self.buffer)
+            self.written += len(self.buffer)
+            self.buffer.clear()
+        self.stream.flush()
+
+    def rewind(self, written):
+        """Carries on from a checkpoint taken after written bytes of output.
 
-    while not file.isEnd():
-        current = file.getChar()
+        A seekable stream holding more than that, written by the run after
+        its checkpoint, is cut back so nothing comes out twice. This assumes
+        the stream holds nothing but the program's output.
+        """
+        try:
+            if self.stream.seekable() and self.stream.seek(0, 2) > written:
+                self.stream.truncate(written)
+                self.stream.seek(written)
+        except (AttributeError, OSError):
+            pass
+        self.written = written
 
-        if current == '>':
-            tape.right(file.getOffset())
-            file.movePointer(file.getOffset())
 
-        elif current == '+':
-            tape.add(file.getOffset())
-            file.movePointer(file.getOffset())
+class BFInput:
+    """Hands out input bytes read from a binary stream in blocks.
 
-        elif current == '<':
-            tape.left(file.getOffset())
-            file.movePointer(file.getOffset())
+    eof is what ',' stores once the input runs out: 0, -1 or None to leave
+    the cell unchanged. Anything waiting in output is flushed before a read
+    that may block, so prompts show up before the program waits on them.
+    """
+    def __init__(self, stream=None, eof=0, size=1 << 16, output=None):
+        self.stream = stream if stream is not None else stdin.buffer
+        self.eof = eof
+        self.size = size
+        self.output = output
+        self.block = b""
+        self.position = 0
+        self.consumed = 0
 
-        elif current == ']':
-            if tape.getCurrent() != 0:
-                file.movePointer(1 - file.getOffset())
+    def next(self):
+        """Returns the next input byte, or the eof value"""
+        if self.position == len(self.block):
+            if self.output is not None:
+                self.output.flush()
+            read = getattr(self.stream, "read1", self.stream.read)
+            self.block = read(self.size)
+            self.position = 0
+            if not self.block:
+                return self.eof
+        self.position += 1
+        self.consumed += 1
+        return self.block[self.position - 1]
+
+    def skip(self, count):
+        """Passes over count bytes of input, the part a checkpointed run
+        already read, seeking when the stream allows it"""
+        self.consumed += count
+        try:
+            self.stream.seek(count, 1)
+        except (AttributeError, OSError):
+            while count:
+                block = self.stream.read(min(count, self.size))
+                if not block:
+                    break
+                count -= len(block)
+        self.block, self.position = b"", 0
+
+
+class BFCheckpoint:
+    """Snapshots the state of a run to file every so often.
+
+    A snapshot is taken whenever every steps have passed or interval
+    seconds, and as soon as possible once requested is set, after which the
+    run stops with Checkpointed. Checks happen as loops jump back, at most
+    once every CLOCK_INTERVAL steps. Snapshots are written
+    aside and renamed into place, so a run killed while saving leaves the
+    last one intact.
+    """
+    def __init__(self, file, program, every=None, interval=None):
+        self.file = file
+        self.key = program.key if program.source is None \
+            else programKey(program.source, program.passes)
+        self.every = every
+        self.interval = interval
+        self.requested = False
+        self.nextStep = UNLIMITED if every is None else every
+        self.nextTime = UNLIMITED if interval is None \
+            else monotonic() + interval
+
+    def due(self, steps):
+        """Whether a snapshot is needed at this step count"""
+        return self.requested or steps >= self.nextStep or \
+            monotonic() >= self.nextTime
+
+    def save(self, tape, output, input, index, steps):
+        """Writes the state of a run that continues at code index"""
+        output.flush()
+        cells = tape.tapeRoll
+        data = cells if isinstance(cells, bytearray) else cells.tobytes()
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+            b"<" if sys.byteorder == "little" else b">", self.key, index,
+            steps, tape.pointer, tape.origin, tape.mask.bit_length(),
+            tape.grow, tape.size, output.written, input.consumed)
+        with open(self.file + ".tmp", "wb") as snapshot_file:
+            snapshot_file.write(header)
+            snapshot_file.write(zlib.compress(data, 1))
+        replace(self.file + ".tmp", self.file)
+        if self.every is not None:
+            self.nextStep = steps + self.every
+        if self.interval is not None:
+            self.nextTime = monotonic() + self.interval
+        if self.requested:
+            raise Checkpointed(self.file)
+
+    def restore(self, tape, output, input):
+        """Loads the snapshot into a run, returns the index and steps to
+        pass to execute. Raises ValueError for snapshots of another
+        program or ones it can't read."""
+        with open(self.file, "rb") as snapshot_file:
+            header = snapshot_file.read(SNAPSHOT_HEADER.size)
+            data = snapshot_file.read()
+        if len(header) < SNAPSHOT_HEADER.size:
+            raise ValueError("{} is truncated".format(self.file))
+        magic, version, order, key, index, steps, pointer, origin, bits, \
+            grow, size, written, consumed = SNAPSHOT_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("{} is not a checkpoint".format(self.file))
+        if key != self.key:
+            raise ValueError("{} is a checkpoint of another program"
+                             .format(self.file))
+        fresh = BFTape(0, bits, grow)
+        cells = fresh.tapeRoll
+        data = zlib.decompress(data)
+        if isinstance(cells, bytearray):
+            cells.extend(data)
+        else:
+            cells.frombytes(data)
+            if order != (b"<" if sys.byteorder == "little" else b">"):
+                cells.byteswap()
+        tape.tapeRoll, tape.mask = cells, fresh.mask
+        tape.size, tape.grow = size, bool(grow)
+        tape.pointer, tape.origin = pointer, origin
+        output.rewind(written)
+        input.skip(consumed)
+        if self.every is not None:
+            self.nextStep = steps + self.every
+        return index, steps
+
+
+class BFMemo:
+    """Caches the effect of pure loops of a program, most recent first.
+
+    A loop that does no I/O, has no scans and returns the pointer to where
+    it started touches a fixed window of cells around it, and what it
+    leaves there depends on nothing else. Each run of such a loop is
+    stored keyed by the window it started from, so the next run from the
+    same window is replayed in one go. At most size runs are kept, the
+    least recently used go first.
+    """
+    def __init__(self, program, size=MEMO_SIZE):
+        self.windows = program.loopWindows()
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the (cells, steps) stored under key, or None"""
+        effect = self.entries.get(key)
+        if effect is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return effect
+
+    def put(self, key, cells, steps):
+        """Stores a loop run that took steps and left cells in its window"""
+        if steps < MEMO_STEPS:
+            return
+        self.entries[key] = (cells, steps)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def report(self):
+        """Returns the hit and miss counts as a line of text"""
+        lookups = self.hits + self.misses
+        return "memo: {} hits, {} misses ({:.1%} hit rate), {} stored, " \
+            "{} evicted, {} cacheable loops\n".format(
+                self.hits, self.misses, self.hits / lookups if lookups else 0,
+                len(self.entries), self.evictions, len(self.windows))
+
+
+def parse(source):
+    """Tokenizes bf source into a list of (opcode, operand, offset) tuples.
+
+    Runs are folded as they are read and brackets are matched with a stack,
+    so the cost is linear in the size of the source. The offset is where the
+    instruction starts in the source and is kept for error reporting.
+    """
+    instructions = []
+    depth = []
+    for token in TOKENS.finditer(source):
+        text = token.group()
+        char = text[0]
+        if char in "+-":
+            opcode, operand = ADD, text.count("+") * 2 - len(text)
+        elif char in "<>":
+            opcode, operand = MOVE, text.count(">") * 2 - len(text)
+        elif char in ".,":
+            instructions.append((OUT if char == "." else IN, 0,
+                                 token.start()))
+            continue
+        elif char == "[":
+            depth.append(token.start())
+            instructions.append((OPEN, 0, token.start()))
+            continue
+        else:
+            if not depth:
+                raise SyntaxError("Unmatched ']' at offset {}"
+                                  .format(token.start()))
+            depth.pop()
+            instructions.append((CLOSE, 0, token.start()))
+            continue
+        if instructions and instructions[-1][0] == opcode:
+            # Runs split by comments still fold into one instruction
+            operand += instructions.pop()[1]
+        if operand:
+            instructions.append((opcode, operand, token.start()))
+    if depth:
+        raise SyntaxError("Unmatched '[' at offset {}".format(depth[-1]))
+    return instructions
+
+
+def _rewriteLoops(instructions, rewrite):
+    """Offers the body of every innermost loop to rewrite.
+
+    rewrite gets the list of instructions between the brackets and returns
+    a replacement for the whole loop, or None to leave it alone.
+    """
+    output = []
+    opened = None
+    for instruction in instructions:
+        opcode = instruction[0]
+        if opcode == CLOSE and opened is not None:
+            replacement = rewrite(output[opened + 1:])
+            if replacement is not None:
+                # Replacements inherit the source offset of the loop
+                offset = output[opened][2]
+                del output[opened:]
+                output.extend((op, arg, offset) for op, arg in replacement)
+                opened = None
+                continue
+        output.append(instruction)
+        if opcode == OPEN:
+            opened = len(output) - 1
+        elif opcode == CLOSE:
+            opened = None
+    return output
+
+
+def clearLoops(instructions):
+    """[-] and [+] set the current cell to zero"""
+    def rewrite(body):
+        if len(body) == 1 and body[0][0] == ADD and body[0][1] in (1, -1):
+            return [(ZERO, 0)]
+    return _rewriteLoops(instructions, rewrite)
+
+
+def multiplyLoops(instructions):
+    """Copy and multiply loops such as [->+>++<<] become a single MUL"""
+    def rewrite(body):
+        if any(opcode not in (ADD, MOVE) for opcode, _, _ in body):
+            return None
+        position, deltas = 0, {}
+        for opcode, operand, _ in body:
+            if opcode == MOVE:
+                position += operand
             else:
-                file.movePointer(1)
+                deltas[position] = deltas.get(position, 0) + operand
+        if position != 0 or deltas.pop(0, 0) != -1:
+            return None
+        targets = tuple((offset, factor)
+                        for offset, factor in sorted(deltas.items())
+                        if factor)
+        return [(MUL, targets)] if targets else [(ZERO, 0)]
+    return _rewriteLoops(instructions, rewrite)
+
+
+def scanLoops(instructions):
+    """Scan loops such as [>] or [<<] become a single SCAN"""
+    def rewrite(body):
+        if len(body) == 1 and body[0][0] == MOVE:
+            return [(SCAN, body[0][1])]
+    return _rewriteLoops(instructions, rewrite)
 
-        elif current == '-':
-            tape.sub(file.getOffset())
-            file.movePointer(file.getOffset())
 
-        elif current == '!':
-            tape.zero()
-            file.movePointer(file.getOffset())
+def offsetMoves(instructions):
+    """Defers pointer moves between loops and turns them into cell offsets.
+
+    Inside a straight run of code the pointer only moves once, at the end,
+    and every cell access in between addresses pointer + offset directly.
+    """
+    output = []
+    shift = 0
+    for opcode, operand, offset in instructions:
+        if opcode == MOVE:
+            shift += operand
+            continue
+        elif opcode == ADD and shift:
+            output.append((ADDAT, (shift, operand), offset))
+            continue
+        elif opcode in (ZERO, OUT, IN):
+            output.append((opcode, operand + shift, offset))
+            continue
+        if shift:
+            output.append((MOVE, shift, offset))
+            shift = 0
+        output.append((opcode, operand, offset))
+    if shift:
+        output.append((MOVE, shift, instructions[-1][2]))
+    return output
+
+
+# Optimizer passes in the order they run, each can be disabled from the CLI
+PASSES = {"clear": clearLoops,
+          "multiply": multiplyLoops,
+          "scan": scanLoops,
+          "offset": offsetMoves}
+
+
+def optimize(source, passes=tuple(PASSES)):
+    """Parses source and runs it through the named optimizer passes"""
+    instructions = parse(source)
+    for name in passes:
+        instructions = PASSES[name](instructions)
+    return instructions
+
+
+def reaches(instructions):
+    """Furthest any instruction reaches below and above the pointer"""
+    below = above = 0
+    for opcode, operand, _ in instructions:
+        if opcode in (ZERO, OUT, IN):
+            targets = [operand]
+        elif opcode == ADDAT:
+            targets = [operand[0]]
+        elif opcode == MUL:
+            targets = [target for target, _ in operand]
+        else:
+            continue
+        below = max([below] + [-target for target in targets])
+        above = max([above] + targets)
+    return below, above
+
 
-        elif current == '[':
-            if tape.getCurrent() == 0:
-                file.movePointer(file.getOffset() + 1)
+def depth(instructions):
+    """Deepest the loops among instructions nest"""
+    deepest = level = 0
+    for opcode, _, _ in instructions:
+        if opcode == OPEN:
+            level += 1
+            deepest = max(deepest, level)
+        elif opcode == CLOSE:
+            level -= 1
+    return deepest
+
+
+def pythonSource(instructions):
+    """Renders optimized instructions as the Python function run.
+
+    run(tape, cells, pointer, mask, write, read) executes the program on the
+    cells of the tape and returns the final pointer, so all the hot state
+    stays local. write and read are BFOutput.write and BFInput.next.
+    """
+    below, above = reaches(instructions)
+    reach = max(below, above)
+    zone = "low, high = tape.zone(pointer, {}, {})".format(below, above)
+    lines = ["def run(tape, cells, pointer, mask, write, read):",
+             "    pointer = tape.reach(pointer, {})".format(reach),
+             "    " + zone]
+    bounds = ["if not low <= pointer < high:",
+              "    pointer = tape.reach(pointer, {})".format(reach),
+              "    " + zone]
+    spaces = "    "
+    # Lowest and highest offset reached by the current straight run, which
+    # is checked against the ends of a fixed tape wherever it ends
+    span = [0, 0]
+    for opcode, operand, _ in instructions + [(None, None, None)]:
+        if opcode in (ZERO, OUT, IN):
+            span = [min(span[0], operand), max(span[1], operand)]
+        elif opcode == ADDAT:
+            span = [min(span[0], operand[0]), max(span[1], operand[0])]
+        elif opcode not in (ADD, MOVE, MUL):
+            if span != [0, 0]:
+                lines.append("{}if not low <= pointer < high:".format(spaces))
+                lines.append("{}    tape.check(pointer, ({}, {}))"
+                             .format(spaces, *span))
+            span = [0, 0]
+        if opcode == ADD:
+            lines.append("{}cells[pointer] = (cells[pointer] + {}) & mask"
+                         .format(spaces, operand))
+        elif opcode == MOVE:
+            lines.append("{}pointer += {}".format(spaces, operand))
+            lines.append("{}if not low <= pointer < high:".format(spaces))
+            lines.append("{}    tape.check(pointer - {}, ({}, {}))"
+                         .format(spaces, operand, *span))
+            lines.extend(spaces + line for line in bounds[1:])
+            span = [0, 0]
+        elif opcode == ADDAT:
+            lines.append("{0}cells[pointer + {1}] = "
+                         "(cells[pointer + {1}] + {2}) & mask"
+                         .format(spaces, *operand))
+        elif opcode == ZERO:
+            lines.append("{}cells[pointer + {}] = 0".format(spaces, operand))
+        elif opcode == OUT:
+            lines.append("{}write(cells[pointer + {}])"
+                         .format(spaces, operand))
+        elif opcode == IN:
+            lines.append("{}value = read()".format(spaces))
+            lines.append("{}if value is not None:".format(spaces))
+            lines.append("{}    cells[pointer + {}] = value & mask"
+                         .format(spaces, operand))
+        elif opcode == OPEN:
+            lines.append("{}while cells[pointer]:".format(spaces))
+            spaces += "    "
+        elif opcode == CLOSE:
+            if lines[-1].endswith(":"):
+                lines.append("{}pass".format(spaces))
+            spaces = spaces[:-4]
+        elif opcode == MUL:
+            lines.append("{}value = cells[pointer]".format(spaces))
+            lines.append("{}if value:".format(spaces))
+            lines.append("{}    if not low <= pointer < high:".format(spaces))
+            lines.append("{}        tape.check(pointer, ({}, {}))".format(
+                spaces, min([0] + [target for target, _ in operand]),
+                max([0] + [target for target, _ in operand])))
+            for target in operand:
+                lines.append("{0}    cells[pointer + {1}] = "
+                             "(cells[pointer + {1}] + value * {2}) & mask"
+                             .format(spaces, *target))
+            lines.append("{}    cells[pointer] = 0".format(spaces))
+        elif opcode == SCAN:
+            lines.append("{}pointer = tape.scan(pointer, {})"
+                         .format(spaces, operand))
+            lines.extend(spaces + line for line in bounds)
+    lines.append("    return pointer")
+    return "\n".join(lines) + "\n"
+
+
+def jitCompile(source, passes=tuple(PASSES), cache=None):
+    """Compiles bf source into a Python function, see pythonSource.
+
+    With a cache directory the marshalled code object is stored under a hash
+    of the source, the passes and the Python version, so later runs of the
+    same program skip parsing and compiling entirely. Returns None when the
+    program nests too deeply for CPython to compile.
+    """
+    key = sha256("{}:{}:{}:".format(JIT_VERSION, implementation.cache_tag,
+                                    ",".join(passes)).encode()
+                 + source.encode()).hexdigest()
+    cached = path.join(cache, key + ".jit") if cache is not None else None
+    code = None
+    if cached is not None and path.exists(cached):
+        with open(cached, "rb") as cache_file:
+            try:
+                code = marshal.load(cache_file)
+            except (EOFError, ValueError, TypeError):
+                code = None
+    if code is None:
+        instructions = optimize(source, passes)
+        # Checked up front, rendering and parsing deep programs is costly
+        if depth(instructions) > JIT_DEPTH:
+            return None
+        try:
+            code = builtins.compile(pythonSource(instructions),
+                                    "<bf jit>", "exec")
+        except (SyntaxError, RecursionError, MemoryError):
+            return None
+        if cached is not None:
+            makedirs(cache, exist_ok=True)
+            # Written aside and renamed so concurrent runs never see half a file
+            with open(cached + ".tmp", "wb") as cache_file:
+                marshal.dump(code, cache_file)
+            replace(cached + ".tmp", cached)
+    namespace = {}
+    exec(code, namespace)
+    return namespace["run"]
+
+
+def nativeCompile(source, cache, compiler=None, flags="-O2"):
+    """Builds bf source into a shared object and returns a runner for it.
+
+    The C comes from bf_transpiler.CLibConverter and is built with the system
+    compiler ($CC or cc). Libraries are cached under a hash of the source,
+    compiler and flags, so the compile cost is only paid once. The returned
+    function takes the input as bytes and passes the output to write in
+    chunks of up to size bytes as the program runs. Without write it returns
+    the output as bytes instead.
+    """
+    compiler = compiler or environ.get("CC", "cc")
+    key = sha256("{}:{}:{}:".format(NATIVE_VERSION, compiler, flags).encode()
+                 + source.encode()).hexdigest()
+    makedirs(cache, exist_ok=True)
+    library = path.join(cache, key + ".so")
+    if not path.exists(library):
+        sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)),
+                                     path.pardir))
+        try:
+            from bf_transpiler import CLibConverter
+        finally:
+            sys.path.pop(0)
+        c_source = CLibConverter(source).convert()
+        building = "{}.{}".format(library, getpid())
+        with open(building + ".c", "w") as c_file:
+            c_file.write(c_source)
+        try:
+            subprocess.run([compiler] + shlex.split(flags) +
+                           ["-shared", "-fPIC", "-o", building,
+                            building + ".c"], check=True)
+            replace(building, library)
+        finally:
+            remove(building + ".c")
+    flush = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t)
+    bf_run = ctypes.CDLL(library).bf_run
+    bf_run.restype = ctypes.c_int
+    bf_run.argtypes = [ctypes.c_char_p, ctypes.c_size_t,
+                       ctypes.c_char_p, ctypes.c_size_t, flush]
+
+    def run(input=b"", write=None, size=1 << 16):
+        chunks, raised = [], []
+
+        def written(data, length):
+            # Exceptions can't cross into C, so they stop the run and are
+            # raised again once it returns
+            try:
+                (write or chunks.append)(ctypes.string_at(data, length))
+            except BaseException as error:
+                raised.append(error)
+                return 1
+            return 0
+
+        bf_run(input, len(input), ctypes.create_string_buffer(size), size,
+               flush(written))
+        if raised:
+            raise raised[0]
+        return None if write else b"".join(chunks)
+    return run
+
+
+def programKey(source, passes):
+    """Hash identifying the compiled form of source under passes"""
+    return sha256("{}:{}:".format(BFC_VERSION, ",".join(passes)).encode()
+                  + source.encode()).digest()
+
+
+def _aligned(size):
+    return -(-size // BFC_ALIGN) * BFC_ALIGN
+
+
+class Program:
+    """A compiled bf program, see compile"""
+    def __init__(self, source, passes=tuple(PASSES)):
+        self.source = source
+        self.passes = tuple(passes)
+        self.code = []
+        self.consts = []
+        self.offsets = []
+        self.margin = 0
+        self.reaches = (0, 0)
+        self.spans = {}
+        self.compileFile(passes)
+
+    def _constant(self, values):
+        """Stores values in the constant table, returning their index"""
+        index = len(self.consts)
+        self.consts += values
+        return index
+
+    def compileFile(self, passes):
+        """Parses the source, optimizes it and assembles the instruction stream"""
+        instructions = optimize(self.source, passes)
+        self.reaches = reaches(instructions)
+        self.margin = max(self.reaches)
+        code = self.code
+        stack = []
+        for opcode, operand, offset in instructions:
+            if opcode == OPEN:
+                stack.append(len(code))
+            elif opcode == CLOSE:
+                operand = stack.pop()
+                code[operand + 1] = len(code)
+            elif opcode == ADDAT:
+                operand = self._constant(operand)
+            elif opcode == MUL:
+                operand = self._constant([len(operand)] +
+                                         [value for target in operand
+                                          for value in target])
+            code += (opcode, operand)
+            self.offsets.append(offset)
+
+    def span(self, index):
+        """Lowest and highest offset from the pointer reached by the MUL at
+        code index, or else by the straight run of code ending there"""
+        if index in self.spans:
+            return self.spans[index]
+        code, consts = self.code, self.consts
+        low = high = 0
+        if index < len(code) and code[index] == MUL:
+            operand = code[index + 1]
+            for target in range(operand + 1,
+                                operand + 1 + 2 * consts[operand], 2):
+                low, high = min(low, consts[target]), max(high, consts[target])
+        else:
+            start = index
+            while start:
+                start -= 2
+                opcode, operand = code[start], code[start + 1]
+                if opcode in (ZERO, OUT, IN):
+                    offset = operand
+                elif opcode == ADDAT:
+                    offset = consts[operand]
+                elif opcode in (ADD, MUL):
+                    continue
+                else:
+                    break
+                low, high = min(low, offset), max(high, offset)
+        self.spans[index] = low, high
+        return low, high
+
+    def loopWindows(self, width=MEMO_WIDTH):
+        """Finds the loops BFMemo can cache.
+
+        Returns the first and last cell each one touches, relative to the
+        pointer, by the code index of its OPEN. Loops wider than width
+        cells are left out.
+        """
+        code, consts = self.code, self.consts
+        windows = {}
+        at = 0
+        # Open loops: OPEN index, pointer on entry, lowest and highest cell
+        # touched and whether the loop is pure so far
+        stack = []
+        for index in range(0, len(code), 2):
+            opcode, operand = code[index], code[index + 1]
+            if opcode == OPEN:
+                stack.append([index, at, at, at, True])
+                continue
+            elif opcode == CLOSE:
+                start, entry, low, high, pure = stack.pop()
+                pure = pure and at == entry
+                if pure and high - low < width:
+                    windows[start] = (low - entry, high - entry)
+                if stack:
+                    outer = stack[-1]
+                    outer[2], outer[3] = min(outer[2], low), \
+                        max(outer[3], high)
+                    outer[4] = outer[4] and pure
+                continue
+            elif opcode == MOVE:
+                at += operand
+                continue
+            if not stack:
+                continue
+            loop = stack[-1]
+            if opcode == ADD:
+                touched = [at]
+            elif opcode == ZERO:
+                touched = [at + operand]
+            elif opcode == ADDAT:
+                touched = [at + consts[operand]]
+            elif opcode == MUL:
+                touched = [at] + [at + consts[target] for target in
+                                  range(operand + 1,
+                                        operand + 1 + 2 * consts[operand], 2)]
+            else:
+                loop[4] = False
+                continue
+            loop[2], loop[3] = min([loop[2]] + touched), \
+                max([loop[3]] + touched)
+        return windows
+
+    def run(self, input=b"", max_steps=None, bits=8, size=30000,
+            grow=False, eof=0, timeout=None):
+        """Runs the program on a fresh tape and returns its output as bytes.
+
+        input is everything ',' can read. With max_steps set, a run that
+        executes more instructions raises StepLimitExceeded, with timeout
+        one that takes more seconds raises TimeLimitExceeded. bits, size and
+        grow describe the tape (see BFTape), eof the end of input (BFInput).
+        """
+        stream = BytesIO()
+        output = BFOutput(stream, flush="exit")
+        try:
+            self.execute(BFTape(size, bits, grow), output,
+                         BFInput(BytesIO(input), eof), max_steps, timeout)
+        except (StepLimitExceeded, TimeLimitExceeded) as error:
+            output.flush()
+            error.output = stream.getvalue()
+            raise
+        output.flush()
+        return stream.getvalue()
+
+    def execute(self, tape, output, input, max_steps=None, timeout=None,
+                checkpoint=None, index=0, steps=0, memo=None, trace=None):
+        """Executes the program on tape with BFOutput/BFInput I/O.
+
+        Returns the number of instructions executed. Limits are checked
+        whenever a loop jumps back, so straight-line code between loops can
+        overshoot the step budget slightly, and the clock is only read every
+        CLOCK_INTERVAL steps. A BFCheckpoint is given its chance to save at
+        the same points, index and steps continue a run from one. With a
+        BFMemo, loops it has seen from the same cells are replayed. A
+        BFTrace is told about every loop entered, repeated and left.
+        """
+        limit = UNLIMITED if max_steps is None else max_steps
+        deadline = UNLIMITED if timeout is None else monotonic() + timeout
+        # A single comparison per jump covers all the limits and tracing,
+        # check is the next step count at which any of them needs a closer
+        # look
+        check = limit if timeout is None and checkpoint is None \
+            else min(limit, steps + CLOCK_INTERVAL)
+        if trace is not None:
+            check = steps
+        write = output.write
+        read = input.next
+        code = self.code
+        consts = self.consts
+        cells = tape.tapeRoll
+        mask = tape.mask
+        # Between moves the pointer stays far enough from the ends of the
+        # tape for every offset access, so only moves need a bounds check.
+        # Near the ends of a fixed tape the zone is empty and each straight
+        # run is checked where it ends
+        reach = self.margin
+        below, above = self.reaches
+        pointer = tape.reach(tape.pointer, reach)
+        low, high = tape.zone(pointer, below, above)
+        windows = memo.windows if memo is not None else {}
+        freeze = bytes if isinstance(cells, bytearray) else array.tobytes
+        # Loops being recorded for memo: CLOSE index, key, steps on entry
+        recording = []
+        length = len(code)
+        while index < length:
+            opcode = code[index]
+            steps += 1
+            if opcode == ADD:
+                cells[pointer] = (cells[pointer] + code[index + 1]) & mask
+            elif opcode == MOVE:
+                pointer += code[index + 1]
+                if not low <= pointer < high:
+                    # Near the ends of a fixed tape the run that ended here
+                    # could have reached off it
+                    tape.check(pointer - code[index + 1], self.span(index))
+                    pointer = tape.reach(pointer, reach)
+                    low, high = tape.zone(pointer, below, above)
+            elif opcode == ADDAT:
+                operand = code[index + 1]
+                target = pointer + consts[operand]
+                cells[target] = (cells[target] + consts[operand + 1]) & mask
+            elif opcode == CLOSE:
+                if not low <= pointer < high:
+                    tape.check(pointer, self.span(index))
+                if cells[pointer]:
+                    index = code[index + 1]
+                    if steps > check:
+                        tape.pointer = pointer
+                        if steps > limit:
+                            raise StepLimitExceeded(max_steps)
+                        if monotonic() > deadline:
+                            raise TimeLimitExceeded(timeout)
+                        if checkpoint is not None and checkpoint.due(steps):
+                            # The loop body runs next, right after OPEN
+                            checkpoint.save(tape, output, input, index + 2,
+                                            steps)
+                        check = min(limit, steps + CLOCK_INTERVAL)
+                        if trace is not None:
+                            trace.repeat(index)
+                            check = steps
+                elif recording and recording[-1][0] == index:
+                    _, key, began = recording.pop()
+                    left, right = windows[key[0]]
+                    memo.put(key, cells[pointer + left:pointer + right + 1],
+                             steps - began)
+                elif trace is not None:
+                    trace.leave(code[index + 1])
+            elif opcode == OPEN:
+                if not low <= pointer < high:
+                    tape.check(pointer, self.span(index))
+                if not cells[pointer]:
+                    index = code[index + 1]
+                elif index in windows:
+                    left, right = windows[index]
+                    start, end = pointer + left, pointer + right + 1
+                    # A fixed tape must hold the whole window, or a replay
+                    # could hide the loop running off its end
+                    if tape.grow:
+                        inside = start >= 0 and end <= len(cells)
+                    else:
+                        inside = tape.origin <= start and \
+                            end <= tape.origin + tape.size
+                    if inside:
+                        key = (index, freeze(cells[start:end]))
+                        effect = memo.get(key)
+                        if effect is None:
+                            recording.append((code[index + 1], key, steps))
+                        else:
+                            cells[start:end] = effect[0]
+                            steps += effect[1]
+                            index = code[index + 1]
+                elif trace is not None:
+                    trace.enter(index)
+            elif opcode == ZERO:
+                cells[pointer + code[index + 1]] = 0
+            elif opcode == MUL:
+                value = cells[pointer]
+                if value:
+                    if not low <= pointer < high:
+                        tape.check(pointer, self.span(index))
+                    operand = code[index + 1]
+                    for target in range(operand + 1,
+                                        operand + 1 + 2 * consts[operand], 2):
+                        cell = pointer + consts[target]
+                        cells[cell] = (cells[cell] +
+                                       value * consts[target + 1]) & mask
+                    cells[pointer] = 0
+            elif opcode == SCAN:
+                if not low <= pointer < high:
+                    tape.check(pointer, self.span(index))
+                pointer = tape.scan(pointer, code[index + 1])
+                if not low <= pointer < high:
+                    pointer = tape.reach(pointer, reach)
+                    low, high = tape.zone(pointer, below, above)
+            elif opcode == OUT:
+                write(cells[pointer + code[index + 1]])
             else:
-                file.movePointer(1)
+                value = read()
+                if value is not None:
+                    cells[pointer + code[index + 1]] = value & mask
+            index += 2
+        if not low <= pointer < high:
+            tape.check(pointer, self.span(length))
+        tape.pointer = pointer
+        if steps > limit:
+            raise StepLimitExceeded(max_steps)
+        return steps
+
+    def profile(self, tape, output, input):
+        """Executes the program like execute, counting as it goes.
+
+        Every instruction is counted and the time of each loop is measured
+        from entering it to leaving it, nested loops included. Returns a
+        BFProfile of the run.
+        """
+        trace = BFTrace(self)
+        began = perf_counter()
+        self.execute(tape, output, input, trace=trace)
+        return BFProfile(self, trace.counts(), trace.entries, trace.times,
+                         perf_counter() - began)
+
+    def save(self, file, source_file=""):
+        """Writes the compiled program to a .bfc file.
+
+        source_file, relative to the .bfc, is recorded so a later load can
+        tell when the program has gone stale. Leave it empty when there is
+        no source file. The file is written aside and renamed into place.
+        """
+        tables = [array("i", table).tobytes()
+                  for table in (self.code, self.consts, self.offsets)]
+        name = source_file.encode()
+        header = BFC_HEADER.pack(BFC_MAGIC, BFC_VERSION,
+                                 b"<" if sys.byteorder == "little" else b">",
+                                 programKey(self.source, self.passes),
+                                 *self.reaches, len(name), len(self.code),
+                                 len(self.consts), len(self.offsets))
+        with open(file + ".tmp", "wb") as bfc_file:
+            for chunk in [header, name] + tables:
+                bfc_file.write(chunk)
+                bfc_file.write(bytes(_aligned(len(chunk)) - len(chunk)))
+        replace(file + ".tmp", file)
+
+    @classmethod
+    def load(cls, file):
+        """Maps a .bfc file into memory and returns it as a Program.
+
+        The tables are used straight from the mapping, nothing is decoded.
+        The returned program has no source, key and sourceFile say what it
+        was compiled from. Raises ValueError for files it can't use.
+        """
+        with open(file, "rb") as bfc_file:
+            if not path.getsize(file):
+                raise ValueError("{} is empty".format(file))
+            mapping = mmap.mmap(bfc_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapping) < BFC_HEADER.size:
+            raise ValueError("{} is truncated".format(file))
+        magic, version, order, key, below, above, *lengths = \
+            BFC_HEADER.unpack_from(mapping)
+        if magic != BFC_MAGIC or version != BFC_VERSION or \
+                order != (b"<" if sys.byteorder == "little" else b">") or \
+                array("i").itemsize != 4:
+            raise ValueError("{} is not a usable .bfc file".format(file))
+        program = cls.__new__(cls)
+        program.source = None
+        program.passes = None
+        program.key = key
+        program.reaches = (below, above)
+        program.margin = max(below, above)
+        program.spans = {}
+        program._mapping = mapping
+        view = memoryview(mapping)
+        start = _aligned(BFC_HEADER.size)
+        program.sourceFile = bytes(view[start:start + lengths[0]]).decode()
+        start += _aligned(lengths[0])
+        tables = []
+        for length in lengths[1:]:
+            if start + length * 4 > len(mapping):
+                raise ValueError("{} is truncated".format(file))
+            tables.append(view[start:start + length * 4].cast("i"))
+            start += _aligned(length * 4)
+        program.code, program.consts, program.offsets = tables
+        return program
+
 
-        elif current == '.':
-            tape.out()
-            file.movePointer(file.getOffset())
+def precompiled(file, passes=tuple(PASSES)):
+    """Returns the Program for a .b or .bfc file, going through the .bfc.
+
+    For a source file the .bfc next to it is used when it is up to date,
+    otherwise the source is compiled and the .bfc rewritten. A .bfc is
+    checked against the source file it records in the same way, and run as
+    it is when that source no longer exists.
+    """
+    if file.endswith(".bfc"):
+        bfc_file, source_file = file, None
+    else:
+        bfc_file, source_file = path.splitext(file)[0] + ".bfc", file
+    program = None
+    if path.exists(bfc_file):
+        try:
+            program = Program.load(bfc_file)
+        except ValueError:
+            if source_file is None:
+                raise
+        else:
+            # Programs saved without a source record an empty path
+            if source_file is None and program.sourceFile:
+                source_file = path.join(path.dirname(bfc_file),
+                                        program.sourceFile)
+    if source_file is None or not path.exists(source_file):
+        if program is None:
+            raise FileNotFoundError("No source or .bfc for {}".format(file))
+        return program
+    with open(source_file) as input:
+        source = input.read()
+    if program is not None and program.key == programKey(source, passes):
+        program.source = source
+        program.passes = tuple(passes)
+        return program
+    program = Program(source, passes)
+    program.save(bfc_file, path.relpath(source_file, path.dirname(bfc_file)
+                                        or "."))
+    return program
+
+
+class BFTrace:
+    """Loop events of a run, gathered for Program.profile.
+
+    Program.execute reports each loop it enters, each jump back to the
+    start of one and each time it leaves one, by the index of its OPEN. The
+    code between brackets runs straight through, so that is enough to tell
+    how often every instruction ran.
+    """
+    def __init__(self, program):
+        self.program = program
+        self.entries = [0] * len(program.code)
+        self.repeats = [0] * len(program.code)
+        self.times = [0.0] * len(program.code)
+        self.started = []
+
+    def enter(self, index):
+        self.entries[index] += 1
+        self.started.append(perf_counter())
+
+    def repeat(self, index):
+        self.repeats[index] += 1
+
+    def leave(self, index):
+        self.times[index] += perf_counter() - self.started.pop()
+
+    def counts(self):
+        """How often each instruction ran, indexed like Program.code"""
+        code = self.program.code
+        counts = [0] * len(code)
+        # Times each open loop was reached, it is passed as often
+        reached = []
+        runs = 1
+        for index in range(0, len(code), 2):
+            counts[index] = runs
+            if code[index] == OPEN:
+                reached.append(runs)
+                runs = self.entries[index] + self.repeats[index]
+            elif code[index] == CLOSE:
+                runs = reached.pop()
+        return counts
+
+
+class BFProfile:
+    """Instruction counts and loop timings of a profiled run.
+
+    counts, entries and times are indexed like Program.code: how often each
+    instruction ran, how often each loop was entered and how many seconds
+    were spent inside it.
+    """
+    def __init__(self, program, counts, entries, times, elapsed):
+        self.program = program
+        self.counts = counts
+        self.entries = entries
+        self.times = times
+        self.elapsed = elapsed
+        self.steps = sum(counts)
+        source = program.source
+        self._lines = [0] + [index + 1 for index, char
+                             in enumerate(source or "") if char == "\n"]
+
+    def position(self, index):
+        """Source offset, line and column (both from 1) of an instruction"""
+        offset = self.program.offsets[index // 2]
+        line = bisect_right(self._lines, offset)
+        return offset, line, offset - self._lines[line - 1] + 1
+
+    def loops(self):
+        """Loops that ran, hottest (most steps inside them) first"""
+        code = self.program.code
+        # Prefix sums make the steps inside any loop a single subtraction
+        total = [0]
+        for index in range(0, len(code), 2):
+            total.append(total[-1] + self.counts[index])
+        loops = []
+        for index in range(0, len(code), 2):
+            if code[index] != OPEN or not self.entries[index]:
+                continue
+            close = code[index + 1]
+            offset, line, column = self.position(index)
+            steps = total[close // 2 + 1] - total[index // 2]
+            loops.append({"offset": offset, "line": line, "column": column,
+                          "entries": self.entries[index],
+                          "iterations": self.counts[close],
+                          "steps": steps,
+                          "share": steps / self.steps,
+                          "time": self.times[index]})
+        loops.sort(key=lambda loop: loop["steps"], reverse=True)
+        return loops
+
+    def report(self, limit=20):
+        """Returns a ranked, human readable hot loop report"""
+        lines = ["{} steps in {:.3f}s ({:,.0f} steps/s)"
+                 .format(self.steps, self.elapsed,
+                         self.steps / self.elapsed if self.elapsed else 0),
+                 "",
+                 "{:>8} {:>12} {:>12} {:>14} {:>7} {:>9}"
+                 .format("line:col", "entries", "iterations", "steps",
+                         "share", "time")]
+        for loop in self.loops()[:limit]:
+            lines.append("{:>8} {:>12} {:>12} {:>14} {:>6.1%} {:>8.3f}s"
+                         .format("{}:{}".format(loop["line"], loop["column"]),
+                                 loop["entries"], loop["iterations"],
+                                 loop["steps"], loop["share"], loop["time"]))
+        return "\n".join(lines) + "\n"
+
+    def toJSON(self):
+        """Returns the profile as JSON-serializable data"""
+        code = self.program.code
+        instructions = []
+        for index in range(0, len(code), 2):
+            if self.counts[index]:
+                offset, line, column = self.position(index)
+                instructions.append({"index": index // 2,
+                                     "opcode": OPCODES[code[index]],
+                                     "offset": offset, "line": line,
+                                     "column": column,
+                                     "count": self.counts[index]})
+        return {"steps": self.steps, "time": self.elapsed,
+                "loops": self.loops(), "instructions": instructions}
+
+
+class BFFile(Program):
+    """A Program read from a bf source file"""
+    def __init__(self, file, passes=tuple(PASSES)):
+        with open(file) as input:
+            super().__init__(input.read(), passes)
+
+
+def compile(source, passes=tuple(PASSES)):
+    """Compiles bf source into a Program that can be run repeatedly"""
+    return Program(source, passes)
+
+
+if __name__ == "__main__":
+    def get_arguments():
+        """Retrieves command line arguments"""
+        parser = argparse.ArgumentParser()
+        parser.add_argument("input",
+                            help="The bf file to run")
+        for name, optimizer in PASSES.items():
+            parser.add_argument("--no-{}".format(name),
+                                action="append_const",
+                                const=name,
+                                dest="disabled",
+                                default=[],
+                                help="Disable the {} pass: {}"
+                                .format(name, optimizer.__doc__.split("\n")[0]))
+        parser.add_argument("--cell-bits",
+                            action="store",
+                            type=int,
+                            choices=(8, 16, 32),
+                            default=8,
+                            help="Width of a tape cell, arithmetic wraps "
+                                 "around at this width")
+        parser.add_argument("--tape-size",
+                            action="store",
+                            type=int,
+                            default=30000,
+                            help="Number of cells on the tape")
+        parser.add_argument("--grow",
+                            action="store_true",
+                            help="Extend the tape whenever the pointer runs "
+                                 "off either end")
+        parser.add_argument("--flush",
+                            action="store",
+                            choices=("newline", "size", "exit"),
+                            help="When buffered output is written: after "
+                                 "each line, once --buffer-size bytes are "
+                                 "waiting or only at exit. Defaults to "
+                                 "newline on a terminal and size otherwise")
+        parser.add_argument("--buffer-size",
+                            action="store",
+                            type=int,
+                            default=1 << 16,
+                            help="Size of the input and output buffers")
+        parser.add_argument("--eof",
+                            action="store",
+                            choices=("0", "-1", "unchanged"),
+                            default="0",
+                            help="What ',' stores once input runs out")
+        parser.add_argument("--max-steps",
+                            action="store",
+                            type=int,
+                            help="Stop programs that run more instructions "
+                                 "than this, not enforced by --jit and "
+                                 "not supported by --native")
+        parser.add_argument("--profile",
+                            action="store_true",
+                            help="Count instructions and time loops, then "
+                                 "print a hot loop report to stderr")
+        parser.add_argument("--profile-json",
+                            action="store",
+                            help="Also write the profile as JSON to this "
+                                 "file")
+        parser.add_argument("--bfc",
+                            action="store_true",
+                            help="Run from the precompiled .bfc next to the "
+                                 "input, (re)building it when it is stale. "
+                                 "Implied when the input is a .bfc file")
+        parser.add_argument("--emit-bfc",
+                            action="store_true",
+                            help="Write the precompiled program to a .bfc "
+                                 "file and exit")
+        parser.add_argument("--bfc-output",
+                            action="store",
+                            metavar="PATH",
+                            help="Where --emit-bfc writes the program, "
+                                 "default next to the input")
+        parser.add_argument("--jit",
+                            action="store_true",
+                            help="Compile to Python bytecode and run that")
+        parser.add_argument("--native",
+                            action="store_true",
+                            help="Compile to a shared library with the "
+                                 "system C compiler and run that, on the "
+                                 "default tape")
+        parser.add_argument("--cc",
+                            action="store",
+                            help="C compiler for --native, defaults to $CC "
+                                 "or cc")
+        parser.add_argument("--cflags",
+                            action="store",
+                            default="-O2",
+                            help="Compiler flags for --native")
+        parser.add_argument("--checkpoint",
+                            action="store",
+                            metavar="FILE",
+                            help="Snapshot the run to this file now and "
+                                 "then and on SIGTERM, which then stops it. "
+                                 "Interpreter only, the file is removed once "
+                                 "the program ends")
+        parser.add_argument("--checkpoint-steps",
+                            action="store",
+                            type=int,
+                            help="Steps between snapshots")
+        parser.add_argument("--checkpoint-interval",
+                            action="store",
+                            type=float,
+                            help="Seconds between snapshots, default 60 "
+                                 "unless --checkpoint-steps is given")
+        parser.add_argument("--resume",
+                            action="store_true",
+                            help="Continue from the --checkpoint file if "
+                                 "there is one. Output to a file continues "
+                                 "where the snapshot was taken")
+        parser.add_argument("--memo",
+                            action="store_true",
+                            help="Cache the effect of pure loops and replay "
+                                 "them. Interpreter only, statistics go to "
+                                 "stderr")
+        parser.add_argument("--memo-size",
+                            action="store",
+                            type=int,
+                            default=MEMO_SIZE,
+                            metavar="ENTRIES",
+                            help="Loop runs --memo keeps, default {}"
+                            .format(MEMO_SIZE))
+        parser.add_argument("--cache-dir",
+                            action="store",
+                            default=path.join(path.expanduser("~"),
+                                              ".cache", "bf-tools"),
+                            help="Where compiled programs are cached")
+        parser.add_argument("--no-cache",
+                            action="store_const",
+                            const=None,
+                            dest="cache_dir",
+                            help="Don't read or write the compile cache")
+        return parser.parse_args()
+
+
+    def load_program():
+        """Compiles the input, going through a .bfc when asked to"""
+        if args.bfc or args.input.endswith(".bfc"):
+            return precompiled(args.input, passes)
+        return BFFile(args.input, passes)
+
+
+    def load_source():
+        """Reads the bf source of the input"""
+        if args.input.endswith(".bfc"):
+            source = precompiled(args.input, passes).source
+            if source is None:
+                exit("The source of {} is gone".format(args.input))
+            return source
+        with open(args.input) as input_file:
+            return input_file.read()
+
+
+    args = get_arguments()
+    passes = [name for name in PASSES if name not in args.disabled]
+    if args.checkpoint is None and args.resume:
+        exit("--resume needs a --checkpoint file")
+    if args.checkpoint is not None and (args.jit or args.native or
+                                        args.profile or args.profile_json):
+        exit("--checkpoint only works with the interpreter")
+    if args.memo and (args.jit or args.native or args.profile or
+                      args.profile_json):
+        exit("--memo only works with the interpreter")
+    if args.native:
+        # The library has a fixed tape of 30000 8 bit cells and reads 0 at EOF
+        unsupported = [option for option, given in (
+            ("--max-steps", args.max_steps is not None),
+            ("--cell-bits", args.cell_bits != 8),
+            ("--tape-size", args.tape_size != 30000),
+            ("--grow", args.grow),
+            ("--eof", args.eof != "0")) if given]
+        if unsupported:
+            exit("{} can't be used with --native"
+                 .format(", ".join(unsupported)))
+    if args.emit_bfc:
+        bfc_file = args.bfc_output or path.splitext(args.input)[0] + ".bfc"
+        BFFile(args.input, passes).save(
+            bfc_file, path.relpath(args.input, path.dirname(bfc_file) or "."))
+        exit()
+    tape = BFTape(args.tape_size, args.cell_bits, args.grow)
+    output = BFOutput(flush=args.flush or ("newline" if stdout.isatty()
+                                           else "size"),
+                      size=args.buffer_size)
+    input = BFInput(eof=None if args.eof == "unchanged" else int(args.eof),
+                    size=args.buffer_size, output=output)
+    run = None
+    if args.native:
+        source = load_source()
+
+        def write(chunk):
+            stdout.buffer.write(chunk)
+            stdout.buffer.flush()
+
+        # Without a cache the library only lives as long as the run
+        with TemporaryDirectory(prefix="bf-") as temporary:
+            native = nativeCompile(source, args.cache_dir or temporary,
+                                   args.cc, args.cflags)
+            # Input is only read when the program can ask for it
+            native(stdin.buffer.read() if "," in source else b"", write,
+                   args.buffer_size)
+        exit()
+    if args.jit:
+        run = jitCompile(load_source(), passes, args.cache_dir)
+        if run is None:
+            stderr.write("Program nests too deeply to JIT, interpreting\n")
+    if args.profile or args.profile_json:
+        try:
+            profile = load_program().profile(tape, output, input)
+        except IndexError as error:
+            output.flush()
+            exit(str(error))
+        finally:
+            output.flush()
+        stderr.write(profile.report())
+        if args.profile_json:
+            with open(args.profile_json, "w") as profile_file:
+                json.dump(profile.toJSON(), profile_file, indent=1)
+        exit()
+    checkpoint, memo, start = None, None, {}
+    if run is None:
+        program = load_program()
+    if args.memo:
+        memo = BFMemo(program, args.memo_size)
+    if args.checkpoint is not None:
+        checkpoint = BFCheckpoint(args.checkpoint, program,
+                                  args.checkpoint_steps,
+                                  args.checkpoint_interval or
+                                  (None if args.checkpoint_steps else 60))
+        if args.resume and path.exists(args.checkpoint):
+            try:
+                index, steps = checkpoint.restore(tape, output, input)
+            except ValueError as error:
+                exit(str(error))
+            start = {"index": index, "steps": steps}
 
+        def request(signum, frame):
+            checkpoint.requested = True
+        signal.signal(signal.SIGTERM, request)
+    try:
+        if run is not None:
+            tape.pointer = run(tape, tape.tapeRoll, tape.pointer, tape.mask,
+                               output.write, input.next)
         else:
-            file.movePointer(file.getOffset())
+            program.execute(tape, output, input, args.max_steps,
+                            checkpoint=checkpoint, memo=memo, **start)
+            if checkpoint is not None and path.exists(args.checkpoint):
+                remove(args.checkpoint)
+    except (StepLimitExceeded, Checkpointed, IndexError) as error:
+        # IndexError is the pointer leaving a fixed tape
+        output.flush()
+        exit(str(error))
+    finally:
+        output.flush()
+        if memo is not None:
+            stderr.write(memo.report())
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+    bf_batch.py
+    Runs many independent bf jobs across a pool of worker processes
+
+    The manifest is a JSON lines file, one job per line:
+
+        {"id": "hello", "program": "hello.b", "input": "some text"}
+
+    A job names its source with "program" (a path, relative to the manifest)
+    or gives it inline as "source". Input is "input" (text, code points
+    0-255 stand for bytes) or "input_file" (a path). "max_steps" and
+    "timeout" override the command line defaults for that job.
+
+    Results are written as JSON lines in the order jobs finish, with
+    "status" one of ok, step_limit, timeout or error. Output is text in the
+    same byte-per-code-point form as the input. A job whose worker process
+    dies is retried once in a fresh pool, then reported as an error.
+"""
+
+import argparse
+import json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from os import cpu_count, path
+from sys import stdout
+from time import perf_counter
+
+import bf
+
+# Limits of a job that doesn't set its own
+MAX_STEPS = 10 ** 8
+TIMEOUT = 60.0
+
+# Runs of a job whose worker died before it is reported as an error
+ATTEMPTS = 2
+
+
+@lru_cache(maxsize=64)
+def _program(source):
+    """Compiles source once per worker, jobs often share a program"""
+    return bf.compile(source)
+
+
+def run_job(job, max_steps, timeout):
+    """Runs one manifest job and returns its result record"""
+    result = {"id": job.get("id")}
+    began = perf_counter()
+    try:
+        if "source" in job:
+            source = job["source"]
+        else:
+            with open(job["program"]) as program_file:
+                source = program_file.read()
+        if "input_file" in job:
+            with open(job["input_file"], "rb") as input_file:
+                input = input_file.read()
+        else:
+            input = job.get("input", "").encode("latin-1")
+        output = _program(source).run(input,
+                                      max_steps=job.get("max_steps",
+                                                        max_steps),
+                                      timeout=job.get("timeout", timeout))
+        result["status"] = "ok"
+    except bf.StepLimitExceeded as error:
+        result["status"] = "step_limit"
+        output = error.output
+    except bf.TimeLimitExceeded as error:
+        result["status"] = "timeout"
+        output = error.output
+    except Exception as error:
+        result["status"] = "error"
+        result["error"] = "{}: {}".format(type(error).__name__, error)
+        output = None
+    result["time"] = round(perf_counter() - began, 6)
+    if output is not None:
+        result["output"] = output.decode("latin-1")
+    return result
+
+
+def read_manifest(manifest):
+    """Yields the jobs of a manifest with paths resolved against it"""
+    base = path.dirname(path.abspath(manifest))
+    with open(manifest) as manifest_file:
+        for number, line in enumerate(manifest_file, 1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            job.setdefault("id", number)
+            for key in ("program", "input_file"):
+                if key in job:
+                    job[key] = path.join(base, job[key])
+            yield job
+
+
+def run_batch(jobs, results, workers=None, max_steps=MAX_STEPS,
+              timeout=TIMEOUT):
+    """Runs jobs on a process pool, writing each result as a JSON line.
+
+    Only a few jobs per worker are queued at a time, so manifests of any
+    length are streamed rather than loaded up front. When a worker dies
+    the pool is replaced and the jobs it took down are run again.
+    """
+    workers = workers or cpu_count() or 1
+    jobs = iter(jobs)
+    # Jobs to run again after their pool broke, with their attempts so far
+    retries = deque()
+    pool = ProcessPoolExecutor(workers)
+    # The job, attempts and pool of every running future
+    pending = {}
+    try:
+        while True:
+            while len(pending) < workers * 4:
+                if retries:
+                    job, attempts = retries.popleft()
+                else:
+                    job, attempts = next(jobs, None), 0
+                    if job is None:
+                        break
+                pending[pool.submit(run_job, job, max_steps, timeout)] = \
+                    (job, attempts + 1, pool)
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, attempts, owner = pending.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as error:
+                    if owner is pool:
+                        pool.shutdown(wait=False)
+                        pool = ProcessPoolExecutor(workers)
+                    if attempts < ATTEMPTS:
+                        retries.append((job, attempts))
+                        continue
+                    result = {"id": job.get("id"), "status": "error",
+                              "error": "Worker process died: {}"
+                              .format(error)}
+                except Exception as error:
+                    result = {"id": job.get("id"), "status": "error",
+                              "error": "{}: {}".format(type(error).__name__,
+                                                       error)}
+                results.write(json.dumps(result) + "\n")
+            results.flush()
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    def get_arguments():
+        """Retrieves command line arguments"""
+        parser = argparse.ArgumentParser()
+        parser.add_argument("manifest",
+                            help="JSON lines file describing the jobs")
+        parser.add_argument("-o", "--output",
+                            action="store",
+                            help="Where results are written, default stdout")
+        parser.add_argument("-j", "--jobs",
+                            action="store",
+                            type=int,
+                            help="Worker processes, default one per core")
+        parser.add_argument("--max-steps",
+                            action="store",
+                            type=int,
+                            default=MAX_STEPS,
+                            help="Default step budget of each job, default "
+                                 "{}".format(MAX_STEPS))
+        parser.add_argument("--timeout",
+                            action="store",
+                            type=float,
+                            default=TIMEOUT,
+                            help="Default wall-clock limit of each job in "
+                                 "seconds, default {:g}".format(TIMEOUT))
+        return parser.parse_args()
+
+
+    args = get_arguments()
+    if args.output is not None:
+        with open(args.output, "w") as results:
+            run_batch(read_manifest(args.manifest), results, args.jobs,
+                      args.max_steps, args.timeout)
+    else:
+        run_batch(read_manifest(args.manifest), stdout, args.jobs,
+                  args.max_steps, args.timeout)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+"""
+    bench.py
+    Benchmarks the interpreter, the transpiler and the text encoders
+
+    Every program in corpus/ is parsed and run by bf.py, with and without
+    loop memoization, and converted by each bf_transpiler.py backend, and
+    corpus/text.txt is encoded by both text2bf.py encoders:
+
+        python3 benchmarks/bench.py -o baseline.json
+        python3 benchmarks/bench.py --compare baseline.json
+
+    Results are written as JSON, each one the best of --repeat runs. With
+    --compare, results more than --threshold worse than the baseline are
+    reported as regressions and the exit status is 1.
+"""
+
+import argparse
+import json
+import platform
+import sys
+from glob import glob
+from io import BytesIO
+from os import path
+from time import perf_counter
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+CORPUS = path.join(path.dirname(path.abspath(__file__)), "corpus")
+
+sys.path[:0] = [ROOT, path.join(ROOT, "Interpreters")]
+import bf
+import bf_transpiler
+from text2bf import CompactEncode, Encode
+
+# Backends by the name of their command line flag
+BACKENDS = {"c": bf_transpiler.CConverter,
+            "clib": bf_transpiler.CLibConverter,
+            "python": bf_transpiler.PyConverter,
+            "arduino": bf_transpiler.ArduinoConverter,
+            "java": bf_transpiler.JavaConverter,
+            "rust": bf_transpiler.RustConverter,
+            "swift": bf_transpiler.SwiftConverter,
+            "javascript": bf_transpiler.JavaScriptConverter,
+            "csharp": bf_transpiler.CSharpConverter,
+            "shell": bf_transpiler.BashConverter}
+
+# Text encoders, by whether text2bf.py uses them with --simple
+ENCODERS = {"simple": Encode,
+            "compact": CompactEncode}
+
+
+def best(function, repeat):
+    """Calls function repeat times, returns the shortest time and a result"""
+    times = []
+    for _ in range(repeat):
+        began = perf_counter()
+        result = function()
+        times.append(perf_counter() - began)
+    return min(times), result
+
+
+def corpus():
+    """Returns the corpus programs as a sorted list of (name, source)"""
+    programs = []
+    for file_name in sorted(glob(path.join(CORPUS, "*.b"))):
+        with open(file_name) as program_file:
+            programs.append((path.splitext(path.basename(file_name))[0],
+                             program_file.read()))
+    return programs
+
+
+def execute(program, memo=None):
+    """Runs a compiled program without input, returns the steps it took"""
+    output = bf.BFOutput(BytesIO(), flush="exit")
+    return program.execute(bf.BFTape(), output,
+                           bf.BFInput(BytesIO(b""), output=output),
+                           memo=memo)
+
+
+def benchmark(repeat, selected=""):
+    """Runs every benchmark whose name contains selected.
+
+    Returns a dict of results by name, each one its value, unit and
+    whether "higher" or "lower" is better.
+    """
+    results = {}
+
+    def record(name, value, unit, better="higher"):
+        results[name] = {"value": value, "unit": unit, "better": better}
+
+    def wanted(name):
+        return selected in name
+
+    programs = corpus()
+    for name, source in programs:
+        if wanted("parse/" + name):
+            seconds, _ = best(lambda: bf.compile(source), repeat)
+            record("parse/" + name, seconds, "s", "lower")
+        if wanted("interpreter/" + name):
+            program = bf.compile(source)
+            seconds, steps = best(lambda: execute(program), repeat)
+            record("interpreter/" + name, steps / seconds, "steps/s")
+        if wanted("memo/" + name):
+            program = bf.compile(source)
+            seconds, steps = best(lambda: execute(program, bf.BFMemo(program)),
+                                  repeat)
+            record("memo/" + name, steps / seconds, "steps/s")
+        for backend, Converter in BACKENDS.items():
+            if wanted("transpile/{}/{}".format(backend, name)):
+                seconds, _ = best(lambda: Converter(source, name).convert(),
+                                  repeat)
+                record("transpile/{}/{}".format(backend, name),
+                       len(source) / seconds, "bytes/s")
+    with open(path.join(CORPUS, "text.txt")) as text_file:
+        text = text_file.read()
+    for encoder, Encoder in ENCODERS.items():
+        if wanted("encode/{}/text".format(encoder)):
+            seconds, code = best(lambda: Encoder(text).recode(), repeat)
+            record("encode/{}/text".format(encoder), len(text) / seconds,
+                   "chars/s")
+            record("encoded/{}/text".format(encoder), len(code), "bytes",
+                   "lower")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns a line for each result in both runs and the regressions.
+
+    A result regresses when it is worse than the baseline by more than
+    threshold, a fraction of the baseline value.
+    """
+    lines, regressions = [], []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["value"], result["value"]
+        change = (after - before) / before if before else 0.0
+        worse = -change if result["better"] == "higher" else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        lines.append("{:<32} {:>14.6g} {:>14.6g} {:>+8.1%} {}{}".format(
+            name, before, after, change, result["unit"], flag))
+    return lines, regressions
+
+
+if __name__ == "__main__":
+    def get_arguments():
+        """Retrieves command line arguments"""
+        parser = argparse.ArgumentParser()
+        parser.add_argument("-o", "--output",
+                            action="store",
+                            help="Where the results are written as JSON, "
+                                 "default stdout")
+        parser.add_argument("-r", "--repeat",
+                            action="store",
+                            type=int,
+                            default=3,
+                            help="Runs of each benchmark, the best is kept")
+        parser.add_argument("-k", "--select",
+                            action="store",
+                            default="",
+                            help="Only run benchmarks with this in their "
+                                 "name, like interpreter/ or /text")
+        parser.add_argument("-c", "--compare",
+                            action="store",
+                            metavar="BASELINE",
+                            help="JSON results of an earlier run to compare "
+                                 "against")
+        parser.add_argument("-t", "--threshold",
+                            action="store",
+                            type=float,
+                            default=0.1,
+                            help="Slowdown counted as a regression, as a "
+                                 "fraction, default 0.1")
+        return parser.parse_args()
+
+
+    args = get_arguments()
+    report = {"python": "{} {}".format(platform.python_implementation(),
+                                       platform.python_version()),
+              "machine": platform.machine(),
+              "repeat": args.repeat,
+              "results": benchmark(args.repeat, args.select)}
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    elif args.compare is None:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print("")
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        lines, regressions = compare(report["results"], baseline,
+                                     args.threshold)
+        print("{:<32} {:>14} {:>14} {:>8}".format("benchmark", "baseline",
+                                                 "current", "change"))
+        print("\n".join(lines))
+        if regressions:
+            print("{} regression(s) over {:.0%}".format(len(regressions),
+                                                       args.threshold))
+            sys.exit(1)
@@ -21,19 +21,83 @@
 """
 
 import argparse
-from re import sub
-from os import path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from hashlib import sha256
+from io import StringIO
+from re import compile as regex
+from os import cpu_count, path
+from sys import stderr, stdout
+from time import monotonic, perf_counter
+
+# Input is read and tokenized this many characters at a time
+CHUNK_SIZE = 1 << 16
+
+# Generated lines are handed to the output file in batches of this many
+LINE_BATCH = 4096
+
+# Progress is reported at most this often, in seconds
+PROGRESS_INTERVAL = 0.25
+
+# Loop bodies of at least this many IR ops are outlined into functions
+OUTLINE_MIN = 32
+
+# Runs of IR ops longer than this are split into functions, which keeps
+# methods under the 64KB limit of the JVM and compile times down
+OUTLINE_SIZE = 1024
+
+# Default step budget when running programs ahead of time with --evaluate
+EVALUATE_STEPS = 10 ** 7
+
+# Output known ahead of time is written this many bytes at a time
+WRITE_SIZE = 1024
+
+# Cells on the tape of the generated programs
+TAPE_SIZE = 30000
+
+# Characters written as they are in string literals, others are escaped
+LITERAL = frozenset(range(32, 127)) - frozenset(b"\"'\\?")
+
+# Everything that isn't a bf command
+COMMENTS = regex(r"[^<>+\-.,\[\]]+")
+
+# [-] (zeroing loop), runs of +-<> and single other commands
+TOKENS = regex(r"\[-+\]|\++|-+|<+|>+|[.,\[\]]")
+
+# A possible zeroing loop cut off by the end of a chunk
+OPEN_TAIL = regex(r"\[-*$")
 
 
 class Converter(object):
-    """Base class, extend and fill self.op in subclass to add a new language"""
+    """Base class, extend and fill self.op in subclass to add a new language.
+
+    Cell ops are formatted with {at}, the offset of the cell from index as
+    rendered by self.offset (empty for the cell under the pointer), and
+    {value}, a positive count or the factor of a multiply loop. Ops may span
+    several lines, indented relative to their first one. op_write prints
+    output known ahead of time, {value} holds it as the contents of a
+    string literal, each byte in self.escape if it isn't plain ASCII, and
+    {length} its size in bytes.
+
+    self.output holds the prelude, which sets up the tape and buffered I/O.
+    Output is collected in a buffer that is flushed before reading input
+    and in op_final.
+
+    Languages with functions can set self.outline, the most IR ops put in
+    one function, along with op_function_begin, op_function_end and
+    op_call. The tape then has to be global, helper functions follow
+    self.output and main opens with the lines in self.main.
+
+    bits is the width of the cells in the generated code, or None where they
+    are ints that don't wrap around, for running programs ahead of time.
+    """
+    bits = 8
+
     def __init__(self, code):
-        # Removes any comments from the code leaving only valid bf chars
-        self.code = self._parse_code(code)
-        self.code = self._optimize(self.code)
+        # Source text or a text file, it is only read once converting
+        # starts, or a list of IR ops from intermediate()
+        self.code = code
         self.output = []
-        self.status = {"position": 0, "spaces": ""}
-        self.length = len(self.code)
+        self.status = {"spaces": ""}
         self.op = {"add": "",
                    "sub": "",
                    "left": "",
@@ -42,77 +106,305 @@ class Converter(object):
                    "out": "",
                    "loop_begin": "",
                    "loop_end": "",
+                   # Body of a loop with nothing in it, where one is needed
+                   "empty": "",
                    "zero": "",
+                   "mul": "",
+                   "scan_left": "",
+                   "scan_right": "",
+                   "function_begin": "",
+                   "function_end": "",
+                   "call": "",
+                   "write": "",
                    "final": ""}
+        self.main = []
+        self.outline = 0
+        # Step budget for running the program ahead of time, 0 for none
+        self.evaluate = 0
+        self.escape = "\\x{:02x}"
+        # Renders positive and negative cell offsets for {at}
+        self.offset = (" + {}", " - {}")
         self.extension = ""
 
-    def _parse_code(self, code):
-        """Removes non-bf characters from input code"""
-        return sub(r"[^<>+\-.,\[\]]", "", code)
-
-    def _optimize(self, code):
-        """Adds optimizations to input bf code"""
-        # [-] (zeroing loop) to 0, replaced in output by op_zero
-        return sub(r"\[\-+\]", "0", self.code)
-
-    def _count(self):
-        """Counts occurances of char at self.position"""
-        for index in range(self.status["position"], self.length):
-            if self.code[index] != self.code[self.status["position"]]:
-                return index - self.status["position"]
-        return self.length - self.status["position"]
-
-    def _construct(self):
-        """ Constructs the output code by appending each op translation to
-            output list and correctly indents output code.
+    def _chunks(self, progress=None):
+        """Yields the input code a chunk at a time with comments removed.
+
+        progress is called with the number of characters read so far, no
+        more than once every PROGRESS_INTERVAL seconds.
+        """
+        if isinstance(self.code, str):
+            chunks = (self.code[index:index + CHUNK_SIZE]
+                      for index in range(0, len(self.code), CHUNK_SIZE))
+        else:
+            chunks = iter(lambda: self.code.read(CHUNK_SIZE), "")
+        done, reported = 0, monotonic()
+        for chunk in chunks:
+            done += len(chunk)
+            if progress is not None and \
+                    monotonic() - reported >= PROGRESS_INTERVAL:
+                progress(done)
+                reported = monotonic()
+            yield COMMENTS.sub("", chunk)
+        if progress is not None:
+            progress(done)
+
+    def _tokens(self, progress=None):
+        """Yields the code as (instruction, count) run-length tokens.
+
+        [-] (zeroing loop) comes out as the instruction "0", replaced in
+        output by op_zero. Only a run that may continue in the next chunk is
+        held back, so memory use doesn't depend on the size of the code.
         """
-        length = len(self.code)
-        while self.status["position"] < length:
-            print("\r{}/{}".format(self.status["position"] + 1, length), end="")
-            instruction = self.code[self.status["position"]]
-            count = self._count()
-            if instruction == "+":
-                self.output.append(self.op["add"].format(count))
-                self.status["position"] += count
-            elif instruction == "-":
-                self.output.append(self.op["sub"].format(count))
-                self.status["position"] += count
-            elif instruction == "<":
-                self.output.append(self.op["left"].format(count))
-                self.status["position"] += count
-            elif instruction == ">":
-                self.output.append(self.op["right"].format(count))
-                self.status["position"] += count
+        pending, count = None, 0
+        carry = ""
+        for chunk in self._chunks(progress):
+            chunk = carry + chunk
+            # A trailing "[--" may still become a zeroing loop
+            tail = OPEN_TAIL.search(chunk)
+            carry = chunk[tail.start():] if tail else ""
+            for token in TOKENS.finditer(chunk, 0, len(chunk) - len(carry)):
+                text = token.group()
+                instruction = "0" if text[0] == "[" and len(text) > 1 \
+                    else text[0]
+                if instruction == pending and instruction in "+-<>":
+                    count += len(text)
+                    continue
+                if pending is not None:
+                    yield pending, count
+                pending, count = instruction, len(text)
+        for token in TOKENS.finditer(carry):
+            # Only "[" and a run of "-" are left, neither one a zeroing loop
+            text = token.group()
+            if text[0] == pending and pending == "-":
+                count += len(text)
+                continue
+            if pending is not None:
+                yield pending, count
+            pending, count = text[0], len(text)
+        if pending is not None:
+            yield pending, count
+
+    def _ir(self, progress=None):
+        """Yields the code as IR operations.
+
+        Pointer moves are tracked at compile time, so between loop
+        boundaries cells are addressed as index + offset and index itself
+        only changes once, right before a loop begins or ends:
+
+            ("add", offset, value)    ("zero", offset)
+            ("out", offset)           ("in", offset)
+            ("move", distance)        ("loop_begin",)   ("loop_end",)
+            ("mul", offset, factor)   ("scan", step)
+
+        Innermost loops that only move are folded into "scan", those that
+        only add and end where they began, taking 1 off the current cell,
+        into "mul"s for each other cell followed by a "zero". Only the
+        current straight run of code is buffered.
+        """
+        block, shift = [], 0
+        # The loop just opened, whose "loop_begin" waits until its body is
+        # known not to be a scan or multiply loop
+        candidate = False
+        for instruction, count in self._tokens(progress):
+            if instruction in "+-":
+                value = count if instruction == "+" else -count
+                if block and block[-1][:2] == ("add", shift):
+                    value += block.pop()[2]
+                if value:
+                    block.append(("add", shift, value))
+            elif instruction in "<>":
+                shift += count if instruction == ">" else -count
+            elif instruction == "0":
+                block.append(("zero", shift))
             elif instruction == ".":
-                self.output.append(self.op["out"])
-                self.status["position"] += 1
+                block.append(("out", shift))
             elif instruction == ",":
-                self.output.append(self.op["in"])
-                self.status["position"] += 1
+                block.append(("in", shift))
             elif instruction == "[":
-                self.output.append(self.op["loop_begin"])
-                self.status["position"] += 1
-            elif instruction == "]":
-                self.output.append(self.op["loop_end"])
-                self.status["position"] += 1
-                self.status["spaces"] = self.status["spaces"][0:-4]
-            elif instruction == "0":
-                self.output.append(self.op["zero"])
-                self.status["position"] += 1
-            self.output[-1] = self.status["spaces"] + self.output[-1]
-            if instruction == "[":
-                self.status["spaces"] += "    "
-        self.output.append(self.op["final"])
-        print("")
-
-    def _output(self):
-        """Returns output code as a string"""
-        return "\n".join(self.output)
+                if candidate:
+                    yield ("loop_begin",)
+                yield from block
+                if shift:
+                    yield ("move", shift)
+                block, shift, candidate = [], 0, True
+            else:
+                folded = self._fold(block, shift) if candidate else None
+                if folded is not None:
+                    yield from folded
+                else:
+                    if candidate:
+                        yield ("loop_begin",)
+                    yield from block
+                    if shift:
+                        yield ("move", shift)
+                    yield ("loop_end",)
+                block, shift, candidate = [], 0, False
+        if candidate:
+            yield ("loop_begin",)
+        # The pointer doesn't matter any more once the program ends
+        yield from block
+
+    def _fold(self, body, shift):
+        """Returns the IR replacing an innermost loop, None if it can't be"""
+        if not body:
+            return [("scan", shift)] if shift else None
+        if shift or any(op[0] != "add" for op in body):
+            return None
+        factors = {}
+        for _, offset, value in body:
+            factors[offset] = factors.get(offset, 0) + value
+        if factors.pop(0, 0) != -1:
+            return None
+        return [("mul", offset, factor)
+                for offset, factor in sorted(factors.items())
+                if factor] + [("zero", 0)]
+
+    def _literal(self, data):
+        """Renders bytes as the contents of a string literal"""
+        return "".join(chr(byte) if byte in LITERAL
+                       else self.escape.format(byte) for byte in data)
+
+    def _at(self, offset):
+        """Renders a cell offset for the {at} field"""
+        if offset > 0:
+            return self.offset[0].format(offset)
+        elif offset < 0:
+            return self.offset[1].format(-offset)
+        return ""
+
+    def _outline(self, ops):
+        """Yields helper functions outlined from the IR ops, returns the rest.
+
+        Loops with bodies of OUTLINE_MIN ops or more become functions, and
+        so does each run of self.outline ops within any one body. Helpers
+        are keyed on a hash of their code, so identical loops share one.
+        Every helper comes before its first caller, which leaves only the
+        code of main to be returned.
+
+        Each open body is a list of levels. Ops go into level 0, and a full
+        level is replaced by a call in the next one up, so long code turns
+        into a shallow tree of calls rather than a chain.
+        """
+        helpers = {}
+        bodies = [[[]]]
+        for op in ops:
+            if op[0] == "loop_begin":
+                bodies.append([[]])
+                continue
+            if op[0] == "loop_end" and len(bodies) > 1:
+                body = self._flatten(bodies.pop())
+                code = [("loop_begin",)] + body + [("loop_end",)]
+                if len(body) >= OUTLINE_MIN:
+                    name = yield from self._helper(helpers, "loop", code)
+                    code = [("call", name)]
+                bodies[-1][0].extend(code)
+            else:
+                bodies[-1][0].append(op)
+            levels, level = bodies[-1], 0
+            while len(levels[level]) >= self.outline:
+                name = yield from self._helper(helpers, "block", levels[level])
+                levels[level] = []
+                if level + 1 == len(levels):
+                    levels.append([])
+                level += 1
+                levels[level].append(("call", name))
+        main = self._flatten(bodies[0])
+        # Loops left open by unbalanced code stay open
+        for body in bodies[1:]:
+            main += [("loop_begin",)] + self._flatten(body)
+        return main
+
+    @staticmethod
+    def _flatten(levels):
+        """Returns the code of an open body's levels, earliest first"""
+        return [op for code in reversed(levels) for op in code]
+
+    def _helper(self, helpers, kind, code):
+        """Yields a new helper function running code, returns its name"""
+        key = sha256(repr(code).encode()).digest()
+        if key not in helpers:
+            helpers[key] = "{}_{}".format(kind, len(helpers))
+            yield self.op["function_begin"].format(name=helpers[key])
+            yield from self._render(code)
+            yield self.op["function_end"]
+        return helpers[key]
+
+    def _render(self, ops):
+        """Yields the lines of IR ops, correctly indented"""
+        spaces = [self.status["spaces"]]
+        kind = None
+        for op in ops:
+            last, kind = kind, op[0]
+            if kind == "add":
+                line = self.op["add" if op[2] > 0 else "sub"]\
+                    .format(at=self._at(op[1]), value=abs(op[2]))
+            elif kind == "move":
+                line = self.op["right" if op[1] > 0 else "left"]\
+                    .format(value=abs(op[1]))
+            elif kind in ("zero", "out", "in"):
+                line = self.op[kind].format(at=self._at(op[1]))
+            elif kind == "mul":
+                line = self.op["mul"].format(at=self._at(op[1]), value=op[2])
+            elif kind == "scan":
+                line = self.op["scan_right" if op[1] > 0 else "scan_left"]\
+                    .format(value=abs(op[1]))
+            elif kind == "call":
+                line = self.op["call"].format(name=op[1])
+            elif kind == "write":
+                line = self.op["write"].format(value=self._literal(op[1]),
+                                               length=len(op[1]))
+            elif kind == "loop_begin":
+                yield spaces[-1] + self.op["loop_begin"]
+                spaces.append(spaces[-1] + "    ")
+                continue
+            else:
+                if last == "loop_begin" and self.op["empty"]:
+                    yield spaces[-1] + self.op["empty"]
+                if len(spaces) > 1:
+                    spaces.pop()
+                line = self.op["loop_end"]
+            # Ops spanning several lines are indented as a whole
+            yield spaces[-1] + line.replace("\n", "\n" + spaces[-1])
+
+    def _construct(self, progress=None):
+        """Yields the output code line by line"""
+        for line in self.output:
+            yield line
+        ops = self.code if isinstance(self.code, list) \
+            else self._ir(progress)
+        if self.evaluate and self.op["write"]:
+            ops = partial_evaluate(ops, self.evaluate, self.bits)
+        if self.outline:
+            ops = yield from self._outline(ops)
+        for line in self.main:
+            yield line
+        yield from self._render(ops)
+        yield self.op["final"]
+
+    def write(self, handle, progress=None):
+        """Streams the converted code into the text file handle.
+
+        progress, if given, is called now and then with the number of input
+        characters converted so far.
+        """
+        lines = self._construct(progress)
+        handle.write(next(lines))
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) == LINE_BATCH:
+                handle.write("\n")
+                handle.write("\n".join(batch))
+                batch.clear()
+        if batch:
+            handle.write("\n")
+            handle.write("\n".join(batch))
 
     def convert(self):
         """Public method used to construct and output new code"""
-        self._construct()
-        return self._output()
+        output = StringIO()
+        self.write(output)
+        return output.getvalue()
 
 
 class CConverter(Converter):
@@ -120,40 +412,118 @@ class CConverter(Converter):
     def __init__(self, code, *args):
         super().__init__(code)
         self.output = ["#include <stdio.h>\n",
-                       "int main(void) {",
-                       "    int index = 0;",
-                       "    static char array[30000];"]
-        self.op["add"] = "array[index] += {};"
-        self.op["sub"] = "array[index] -= {};"
-        self.op["left"] = "index -= {};"
-        self.op["right"] = "index += {};"
-        self.op["out"] = "putchar(array[index]);"
-        self.op["in"] = "array[index] = getchar();"
+                       "static int index = 0;",
+                       "static char array[30000];\n"]
+        self.main = ["int main(void) {",
+                     "    static char buffer[1 << 16];",
+                     "    setvbuf(stdout, buffer, _IOFBF, sizeof buffer);"]
+        self.op["add"] = "array[index{at}] += {value};"
+        self.op["sub"] = "array[index{at}] -= {value};"
+        self.op["left"] = "index -= {value};"
+        self.op["right"] = "index += {value};"
+        self.op["out"] = "putchar(array[index{at}]);"
+        self.op["in"] = "fflush(stdout);\narray[index{at}] = getchar();"
         self.op["loop_begin"] = "while (array[index] != 0) {"
         self.op["loop_end"] = "}"
-        self.op["zero"] = "array[index] = 0;"
+        self.op["zero"] = "array[index{at}] = 0;"
+        self.op["mul"] = "array[index{at}] += array[index] * {value};"
+        self.op["scan_left"] = "while (array[index] != 0) index -= {value};"
+        self.op["scan_right"] = "while (array[index] != 0) index += {value};"
+        self.op["function_begin"] = "static void {name}(void) {{"
+        self.op["function_end"] = "}\n"
+        self.op["call"] = "{name}();"
+        self.op["write"] = "fwrite(\"{value}\", 1, {length}, stdout);"
+        self.escape = "\\{:03o}"
         self.op["final"] = "}\n"
         self.extension = "c"
         self.status["spaces"] = " " * 4
+        self.outline = OUTLINE_SIZE
+
+
+class CLibConverter(CConverter):
+    """C shared library converter class, I/O goes through caller buffers.
+
+    Whenever the output buffer fills up, and once the program ends, bf_run
+    passes what it holds to the caller's flush function and carries on. If
+    flush returns nonzero the run stops and bf_run returns 1. The tape is
+    global, so bf_run isn't reentrant, and stopping longjmps out of any
+    outlined functions.
+    """
+    def __init__(self, code, *args):
+        super().__init__(code)
+        self.output = ["#include <setjmp.h>",
+                       "#include <stddef.h>\n",
+                       "static const unsigned char *input;",
+                       "static unsigned char *output;",
+                       "static size_t input_size, output_size, in, out;",
+                       "static int (*flush)(const unsigned char *, size_t);",
+                       "static int index;",
+                       "static unsigned char array[30000];",
+                       "static jmp_buf stop;\n",
+                       "static void put(unsigned char value) {",
+                       "    if (out == output_size) {",
+                       "        if (flush(output, out)) longjmp(stop, 1);",
+                       "        out = 0;",
+                       "    }",
+                       "    output[out++] = value;",
+                       "}\n"]
+        self.main = ["int bf_run(const unsigned char *input_bytes, size_t input_count,",
+                     "           unsigned char *output_bytes, size_t output_count,",
+                     "           int (*flush_output)(const unsigned char *, size_t)) {",
+                     "    input = input_bytes;",
+                     "    input_size = input_count;",
+                     "    output = output_bytes;",
+                     "    output_size = output_count;",
+                     "    flush = flush_output;",
+                     "    in = out = 0;",
+                     "    index = 0;",
+                     "    for (size_t cell = 0; cell < sizeof array; cell++)",
+                     "        array[cell] = 0;",
+                     "    if (setjmp(stop))",
+                     "        return 1;"]
+        self.op["out"] = "put(array[index{at}]);"
+        self.op["in"] = "array[index{at}] = in < input_size ? input[in++] : 0;"
+        self.op["write"] = ("for (size_t at = 0; at < {length}; at++)\n"
+                            "    put((unsigned char) \"{value}\"[at]);")
+        self.op["final"] = "    return flush(output, out);\n}\n"
+        self.extension = "c"
 
 
 class PyConverter(Converter):
     """Python code converter class"""
+    bits = None
+
     def __init__(self, code, *args):
         super().__init__(code)
         self.output = ["#!/usr/bin/env python",
                        "from __future__ import print_function",
                        "from sys import stdin, stdout\n",
+                       "output_stream = getattr(stdout, \"buffer\", stdout)",
+                       "input_stream = getattr(stdin, \"buffer\", stdin)",
+                       "output = bytearray()\n\n",
+                       "def flush():",
+                       "    output_stream.write(bytes(output))",
+                       "    output_stream.flush()",
+                       "    del output[:]\n\n",
                        "index = 0",
                        "array = [0] * 30000"]
-        self.op["add"] = "array[index] += {}"
-        self.op["sub"] = "array[index] -= {}"
-        self.op["left"] = "index -= {}"
-        self.op["right"] = "index += {}"
-        self.op["in"] = "array[index] = ord(stdin.read(1))"
-        self.op["out"] = "stdout.write(chr(array[index]))"
+        self.op["add"] = "array[index{at}] += {value}"
+        self.op["sub"] = "array[index{at}] -= {value}"
+        self.op["left"] = "index -= {value}"
+        self.op["right"] = "index += {value}"
+        self.op["in"] = ("flush()\n"
+                         "array[index{at}] = ord(input_stream.read(1) or b\"\\0\")")
+        self.op["out"] = ("output.append(array[index{at}] & 255)\n"
+                          "if len(output) >= 65536: flush()")
         self.op["loop_begin"] = "while array[index]:"
-        self.op["zero"] = "array[index] = 0"
+        self.op["empty"] = "pass"
+        self.op["zero"] = "array[index{at}] = 0"
+        self.op["mul"] = "array[index{at}] += array[index] * {value}"
+        self.op["scan_left"] = "while array[index]: index -= {value}"
+        self.op["scan_right"] = "while array[index]: index += {value}"
+        self.op["write"] = ("output.extend(b\"{value}\")\n"
+                            "if len(output) >= 65536: flush()")
+        self.op["final"] = "flush()\n"
         self.extension = "py"
 
 
@@ -167,27 +537,38 @@ class ArduinoConverter(CConverter):
                        "    static char array[1850];"]
         self.status["spaces"] = " " * 4
         self.op["in"] = "\n".join(["while (! Serial.available());",
-                                   "{}array[index] = Serial.read();"])\
-                                   .format(self.status["spaces"] + "    ")
-        self.op["out"] = "Serial.print((char) array[index]);"
+                                   "array[index{at}] = Serial.read();"])
+        self.op["out"] = "Serial.print((char) array[index{at}]);"
+        self.op["write"] = "Serial.write((const uint8_t *) \"{value}\", {length});"
         self.op["loop_begin"] = "while (array[index]) {"
         self.op["final"] = "}\n\nvoid loop(){}\n"
         self.extension = "ino"
+        self.main = []
+        self.outline = 0
 
 
 class JavaConverter(CConverter):
     """Java code converter class"""
+    bits = None
+
     def __init__(self, code, package):
         super().__init__(code)
-        self.output = ["import java.io.IOException;",
+        self.output = ["import java.io.BufferedInputStream;",
+                       "import java.io.BufferedOutputStream;",
+                       "import java.io.IOException;",
                        "public class {}{{".format(package.title()),
-                       "    public static void main(String[] args) throws IOException {",
-                       "        int[] array = new int[30000];",
-                       "        int index = 0;"]
+                       "    static BufferedOutputStream output = new BufferedOutputStream(System.out, 1 << 16);",
+                       "    static BufferedInputStream input = new BufferedInputStream(System.in);",
+                       "    static int[] array = new int[30000];",
+                       "    static int index = 0;\n"]
+        self.main = ["    public static void main(String[] args) throws IOException {"]
         self.status["spaces"] = " " * 8
-        self.op["in"] = "array[index] = (int) System.in.read();"
-        self.op["out"] = "System.out.print((char) array[index]);"
-        self.op["final"] = "    }\n}"
+        self.op["function_begin"] = "    static void {name}() throws IOException {{"
+        self.op["function_end"] = "    }\n"
+        self.op["in"] = "output.flush();\narray[index{at}] = input.read();"
+        self.op["out"] = "output.write(array[index{at}]);"
+        self.op["write"] = "output.write(\"{value}\".getBytes(\"ISO-8859-1\"));"
+        self.op["final"] = "        output.flush();\n    }\n}"
         self.extension = "java"
 
 
@@ -195,55 +576,74 @@ class RustConverter(Converter):
     """Rust code converter class"""
     def __init__(self, code, *args):
         super().__init__(code)
-        self.output = ["use std::io::Read;\n",
+        self.output = ["use std::io::{BufReader, BufWriter, Read, Write};\n",
                        "fn main() {",
+                       "    let stdout = std::io::stdout();",
+                       "    let mut output = BufWriter::with_capacity(1 << 16, stdout.lock());",
+                       "    let stdin = std::io::stdin();",
+                       "    let mut input = BufReader::new(stdin.lock()).bytes();",
                        "    let mut array: [u8; 30000] = [0; 30000];",
                        "    let mut index = 0;"]
         self.status["spaces"] = " " * 4
-        self.op["add"] = "array[index] = array[index].wrapping_add({});"
-        self.op["sub"] = "array[index] = array[index].wrapping_sub({});"
-        self.op["left"] = "index -= {};"
-        self.op["right"] = "index += {};"
-        self.op["in"] = "\n".join(["let input: Option<u8> = std::io::stdin()",
-                                   "{}    .bytes()"\
-                                   .format(self.status["spaces"]),
-                                   "{}    .next()"\
-                                   .format(self.status["spaces"]),
-                                   "{}    .and_then(|result| result.ok())"\
-                                   .format(self.status["spaces"]),
-                                   "{}    .map(|byte| byte as u8);"\
-                                   .format(self.status["spaces"]),
-                                   "{}array[index] = input.unwrap();"\
-                                   .format(self.status["spaces"])])
-        self.op["out"] = "print!(\"{}\", array[index] as char);"
+        self.op["add"] = "array[index{at}] = array[index{at}].wrapping_add({value});"
+        self.op["sub"] = "array[index{at}] = array[index{at}].wrapping_sub({value});"
+        self.op["left"] = "index -= {value};"
+        self.op["right"] = "index += {value};"
+        self.op["in"] = "\n".join(["output.flush().unwrap();",
+                                   "array[index{at}] = input.next()",
+                                   "    .and_then(|result| result.ok())",
+                                   "    .unwrap_or(0);"])
+        self.op["out"] = "output.write_all(&[array[index{at}]]).unwrap();"
+        self.op["write"] = "output.write_all(b\"{value}\").unwrap();"
         self.op["loop_begin"] = "while array[index] != 0 {"
         self.op["loop_end"] = "}"
-        self.op["zero"] = "array[index] = 0;"
-        self.op["final"] = "}"
+        self.op["zero"] = "array[index{at}] = 0;"
+        self.op["mul"] = ("array[index{at}] = array[index{at}]"
+                          ".wrapping_add(array[index].wrapping_mul({value}i32 as u8));")
+        self.op["scan_left"] = "while array[index] != 0 {{ index -= {value}; }}"
+        self.op["scan_right"] = "while array[index] != 0 {{ index += {value}; }}"
+        self.op["final"] = "    output.flush().unwrap();\n}"
         self.extension = "rs"
 
 
 class SwiftConverter(Converter):
     """Swift code converter class"""
+    bits = None
+
     def __init__(self, code, *args):
         super().__init__(code)
         self.output = ["import Foundation\n",
+                       "var output = [UInt8]()",
+                       "func flush() {",
+                       "    FileHandle.standardOutput.write(Data(output))",
+                       "    output.removeAll(keepingCapacity: true)",
+                       "}\n",
                        "var array = [CInt](repeating: 0, count: 30000)",
                        "var index = 0"]
-        self.op["add"] = "array[index] += {}"
-        self.op["sub"] = "array[index] -= {}"
-        self.op["left"] = "index -= {}"
-        self.op["right"] = "index += {}"
+        self.op["add"] = "array[index{at}] += {value}"
+        self.op["sub"] = "array[index{at}] -= {value}"
+        self.op["left"] = "index -= {value}"
+        self.op["right"] = "index += {value}"
         self.op["in"] = ""
-        self.op["out"] = "print(String(format:\"%c\", array[index]), terminator:\"\")"
+        self.op["out"] = ("output.append(UInt8(truncatingIfNeeded: array[index{at}]))\n"
+                          "if output.count >= 65536 {{ flush() }}")
         self.op["loop_begin"] = "while array[index] != 0 {"
         self.op["loop_end"] = "}"
-        self.op["zero"] = "array[index] = 0"
+        self.op["zero"] = "array[index{at}] = 0"
+        self.op["mul"] = "array[index{at}] += array[index] * {value}"
+        self.op["scan_left"] = "while array[index] != 0 {{ index -= {value} }}"
+        self.op["scan_right"] = "while array[index] != 0 {{ index += {value} }}"
+        self.op["write"] = ("\"{value}\".unicodeScalars.forEach {{ output.append(UInt8($0.value)) }}\n"
+                            "if output.count >= 65536 {{ flush() }}")
+        self.escape = "\\u{{{:x}}}"
+        self.op["final"] = "flush()\n"
         self.extension = "swift"
 
 
 class JavaScriptConverter(CConverter):
     """Javascript code converter class"""
+    bits = None
+
     def __init__(self, code, *args):
         super().__init__(code)
         self.output = ["<!DOCTYPE HTML>",
@@ -251,12 +651,16 @@ class JavaScriptConverter(CConverter):
                        "    let array = Array.apply(0, Array(30000))"
                        ".map(function () {return 0;});",
                        "    let index = 0;",
-                       "    let output = \"\";"]
-        self.op["out"] = "output = output.concat(String.fromCharCode(array[index]));"
+                       "    let output = [];"]
+        self.op["out"] = "output.push(String.fromCharCode(array[index{at}]));"
+        self.op["write"] = "output.push(\"{value}\");"
+        self.escape = "\\x{:02x}"
         self.op["in"] = ""
-        self.op["final"] = "\n".join(["    alert(output);",
+        self.op["final"] = "\n".join(["    alert(output.join(\"\"));",
                                       "</script>"])
         self.extension = "html"
+        self.main = []
+        self.outline = 0
 
 
 class CSharpConverter(JavaConverter):
@@ -265,32 +669,209 @@ class CSharpConverter(JavaConverter):
         super().__init__(code, package)
         self.output = ["using System;\n"
                        "public class {}{{".format(package.title()),
-                       "    public static void Main(string[] args) {",
-                       "        int[] array = new int[30000];",
-                       "        int index = 0;"]
-        self.op["out"] = "Console.Write((char) array[index]);"
-        self.op["in"] = "array[index] = (int) Console.read();"
+                       "    static System.IO.BufferedStream output = new System.IO.BufferedStream(Console.OpenStandardOutput(), 1 << 16);",
+                       "    static System.IO.BufferedStream input = new System.IO.BufferedStream(Console.OpenStandardInput());",
+                       "    static int[] array = new int[30000];",
+                       "    static int index = 0;\n"]
+        self.main = ["    public static void Main(string[] args) {"]
+        self.op["function_begin"] = "    static void {name}() {{"
+        self.op["out"] = "output.WriteByte((byte) array[index{at}]);"
+        self.op["write"] = "foreach (char character in \"{value}\") output.WriteByte((byte) character);"
+        self.escape = "\\u{:04x}"
+        self.op["in"] = "output.Flush();\narray[index{at}] = input.ReadByte();"
+        self.op["final"] = "        output.Flush();\n    }\n}"
         self.extension = "cs"
 
 
 class BashConverter(Converter):
     """Shell script code converter class"""
+    bits = None
+
     def __init__(self, code, *args):
         super().__init__(code)
         self.output = ["#!/bin/bash\n",
                        "declare -a ARRAY=( $(for i in {1..30000}; do echo 0; done) )",
-                       "declare INDEX=0"]
-        self.op["add"] = "ARRAY[$INDEX]=$((ARRAY[$INDEX]+{}))"
-        self.op["sub"] = "ARRAY[$INDEX]=$((ARRAY[$INDEX]-{}))"
-        self.op["left"] = "INDEX=$(($INDEX-{}))"
-        self.op["right"] = "INDEX=$(($INDEX+{}))"
-        self.op["out"] = "printf \\\\$(printf '%03o' $((ARRAY[$INDEX])))"
-        self.op["loop_begin"] = "while [  ARRAY[$INDEX] != 0  ]; do"
+                       "declare INDEX=0",
+                       "declare OUTPUT=\"\"",
+                       "flush() { printf '%b' \"$OUTPUT\"; OUTPUT=\"\"; }"]
+        self.op["add"] = "ARRAY[$INDEX{at}]=$((ARRAY[$INDEX{at}]+{value}))"
+        self.op["sub"] = "ARRAY[$INDEX{at}]=$((ARRAY[$INDEX{at}]-{value}))"
+        self.op["left"] = "INDEX=$(($INDEX-{value}))"
+        self.op["right"] = "INDEX=$(($INDEX+{value}))"
+        # printf -v is a builtin, so output spawns no subshells
+        self.op["out"] = ("printf -v CHAR '\\\\0%03o' $((ARRAY[$INDEX{at}] & 255))\n"
+                          "OUTPUT+=$CHAR\n"
+                          "(( ${{#OUTPUT}} >= 65536 )) && flush")
+        self.op["loop_begin"] = "while (( ARRAY[$INDEX] != 0 )); do"
         self.op["loop_end"] = "done"
-        self.op["zero"] = "ARRAY[$INDEX]=0"
+        self.op["empty"] = ":"
+        self.op["zero"] = "ARRAY[$INDEX{at}]=0"
+        self.op["mul"] = "ARRAY[$INDEX{at}]=$((ARRAY[$INDEX{at}]+ARRAY[$INDEX]*{value}))"
+        self.op["scan_left"] = "while (( ARRAY[$INDEX] != 0 )); do INDEX=$(($INDEX-{value})); done"
+        self.op["scan_right"] = "while (( ARRAY[$INDEX] != 0 )); do INDEX=$(($INDEX+{value})); done"
+        # Output holds the escapes of printf %b, written in single quotes
+        self.op["write"] = ("OUTPUT+='{value}'\n"
+                            "(( ${{#OUTPUT}} >= 65536 )) && flush")
+        self.escape = "\\0{:03o}"
+        # Subscripts can't hold spaces in an assignment
+        self.offset = ("+{}", "-{}")
+        self.op["final"] = "flush\n"
         self.extension = "sh"
 
 
+def _run(code, tape, pointer, output, budget, mask=255):
+    """Runs IR code on tape, returns the pointer and the steps it took.
+
+    Cells wrap around at mask, -1 for cells that don't. Returns None without
+    running any further as soon as code reads input, steps off the tape,
+    leaves a loop open or goes over budget.
+    """
+    jumps, loops = {}, []
+    for at, op in enumerate(code):
+        if op[0] == "loop_begin":
+            loops.append(at)
+        elif op[0] == "loop_end":
+            if not loops:
+                return None
+            jumps[at] = loops.pop()
+            jumps[jumps[at]] = at
+    if loops:
+        return None
+    at = steps = 0
+    while at < len(code):
+        steps += 1
+        if steps > budget or not 0 <= pointer < len(tape):
+            return None
+        op = code[at]
+        kind = op[0]
+        if kind in ("add", "zero", "out", "mul"):
+            cell = pointer + op[1]
+            if not 0 <= cell < len(tape):
+                return None
+            if kind == "add":
+                tape[cell] = (tape[cell] + op[2]) & mask
+            elif kind == "zero":
+                tape[cell] = 0
+            elif kind == "out":
+                output.append(tape[cell] & 255)
+            else:
+                tape[cell] = (tape[cell] + tape[pointer] * op[2]) & mask
+        elif kind == "move":
+            pointer += op[1]
+        elif kind == "scan":
+            while tape[pointer]:
+                steps += 1
+                pointer += op[1]
+                if steps > budget or not 0 <= pointer < len(tape):
+                    return None
+        elif kind == "loop_begin":
+            if not tape[pointer]:
+                at = jumps[at]
+        elif kind == "loop_end":
+            if tape[pointer]:
+                at = jumps[at]
+        else:
+            return None
+        at += 1
+    return pointer, steps
+
+
+def partial_evaluate(ops, budget=EVALUATE_STEPS, bits=8):
+    """Runs the IR ops of a program as far as it can ahead of time.
+
+    Yields an equivalent program: the output up to where the program first
+    reads input, runs out of the step budget or steps off the tape, written
+    as "write" ops, then ops setting up the tape as it was at that point,
+    followed by the rest of the program. Programs that never read input are
+    only their output. Running stops between top level ops and loops, so a
+    loop that doesn't finish is undone and left to run at run time.
+
+    bits is the cell width of the target language, see Converter.bits.
+    """
+    ops = iter(ops)
+    mask = (1 << bits) - 1 if bits else -1
+    tape = bytearray(TAPE_SIZE) if bits == 8 else [0] * TAPE_SIZE
+    output = bytearray()
+    pointer = 0
+    item = None
+    for op in ops:
+        item = [op]
+        if op[0] == "loop_begin":
+            depth = 1
+            for op in ops:
+                item.append(op)
+                depth += {"loop_begin": 1, "loop_end": -1}.get(op[0], 0)
+                if not depth:
+                    break
+        # Single ops give up before changing anything, loops may not
+        saved, written = tape[:] if len(item) > 1 else None, len(output)
+        ran = _run(item, tape, pointer, output, budget, mask)
+        if ran is None:
+            if saved is not None:
+                tape[:] = saved
+            del output[written:]
+            break
+        pointer, steps = ran
+        budget -= steps
+        item = None
+    for start in range(0, len(output), WRITE_SIZE):
+        yield ("write", bytes(output[start:start + WRITE_SIZE]))
+    if item is None:
+        return
+    # Cells that wrap are set to small signed values, which any char type
+    # holds, the others to their exact value
+    for cell, value in enumerate(tape):
+        if value:
+            yield ("add", cell, value - 256 if bits == 8 and value >= 128
+                   else value)
+    if pointer:
+        yield ("move", pointer)
+    yield from item
+    yield from ops
+
+
+def intermediate(code, progress=None):
+    """Returns the IR of code as a list, so converters can share one parse"""
+    return list(Converter(code)._ir(progress))
+
+
+# IR of the program being converted, set in each convert_all worker
+_shared = None
+
+
+def _share(ir):
+    """Keeps the IR sent to a worker process for all of its targets"""
+    global _shared
+    _shared = ir
+
+
+def _convert_target(converter, name):
+    """Writes the shared IR out as one target, returns the file and time"""
+    began = perf_counter()
+    ir = _shared[converter.bits] if isinstance(_shared, dict) else _shared
+    converter = converter(ir, name)
+    file_name = "{}.{}".format(name, converter.extension)
+    with open(file_name, "w") as output_file:
+        converter.write(output_file)
+    return file_name, perf_counter() - began
+
+
+def convert_all(ir, converters, name, workers=None):
+    """Writes IR with each converter class to name.<extension> in parallel.
+
+    The IR is sent to each worker process once rather than with every
+    target. It may be a dict of IR for each Converter.bits, as evaluated
+    ahead of time by partial_evaluate. Yields (file name, seconds taken) as targets finish.
+    """
+    workers = min(workers or cpu_count() or 1, len(converters))
+    with ProcessPoolExecutor(workers, initializer=_share,
+                             initargs=(ir,)) as pool:
+        targets = [pool.submit(_convert_target, converter, name)
+                   for converter in converters]
+        for target in as_completed(targets):
+            yield target.result()
+
+
 if __name__ == "__main__":
     def get_arguments():
         """Retrieves command line arguments"""
@@ -309,13 +890,36 @@ if __name__ == "__main__":
             parser.add_argument("--{}".format(language),
                                 action="store_true",
                                 help="Output {} code".format(language))
+        parser.add_argument("-p", "--progress",
+                            action="store_true",
+                            help="Report progress on stderr")
+        parser.add_argument("-j", "--jobs",
+                            action="store",
+                            type=int,
+                            help="Worker processes converting several "
+                                 "languages, default one per core")
+        parser.add_argument("-e", "--evaluate",
+                            action="store_true",
+                            help="Run the program ahead of time, writing "
+                                 "its output as constants")
+        parser.add_argument("--evaluate-steps",
+                            action="store",
+                            type=int,
+                            default=EVALUATE_STEPS,
+                            metavar="STEPS",
+                            help="Steps --evaluate runs for at most, "
+                                 "default {}".format(EVALUATE_STEPS))
         return parser.parse_args()
 
 
-    args = get_arguments()
+    def report(done):
+        """Prints how much of the input has been converted"""
+        stderr.write("\r{}/{}".format(done, size))
+        stderr.flush()
 
-    with open(args.input, "r") as input_file:
-        bf_input = input_file.read()
+
+    args = get_arguments()
+    size = path.getsize(args.input)
 
     if args.output is not None:
         # Creates package/output file name by removing extension from input file
@@ -336,13 +940,43 @@ if __name__ == "__main__":
                           (args.javascript, JavaScriptConverter),
                           (args.shell, BashConverter)]
 
-    # Converts each selected option
-    for arg, Converter in language_arguments:
-        if arg or args.all:
-            converter = Converter(bf_input, name)
-            text = converter.convert()
+    converters = [Converter for arg, Converter in language_arguments
+                  if arg or args.all]
+
+    if len(converters) == 1:
+        # A single target streams straight from input to output file
+        with open(args.input, "r") as input_file:
+            converter = converters[0](input_file, name)
+            if args.evaluate:
+                converter.evaluate = args.evaluate_steps
             if name is not None:
                 with open("{}.{}".format(name, converter.extension), "w") as outfile:
-                    outfile.write(text)
+                    converter.write(outfile, report if args.progress else None)
             else:
-                print(text)
+                converter.write(stdout)
+                print("")
+        if args.progress:
+            stderr.write("\n")
+    elif converters:
+        # Several targets share one parse, then render side by side
+        began = perf_counter()
+        with open(args.input, "r") as input_file:
+            ir = intermediate(input_file, report if args.progress else None)
+            if args.evaluate:
+                # Evaluated once for each cell width among the targets
+                widths = {Converter.bits for Converter in converters}
+                ir = {bits: list(partial_evaluate(ir, args.evaluate_steps,
+                                                  bits))
+                      for bits in widths}
+        if args.progress:
+            stderr.write("\n")
+        stderr.write("parse: {:.3f}s\n".format(perf_counter() - began))
+        if name is not None:
+            for file_name, seconds in convert_all(ir, converters, name,
+                                                  args.jobs):
+                stderr.write("{}: {:.3f}s\n".format(file_name, seconds))
+        else:
+            for Converter in converters:
+                Converter(ir[Converter.bits] if args.evaluate else ir,
+                          name).write(stdout)
+                print("")
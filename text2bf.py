@@ -1,14 +1,72 @@
-from sys import argv
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from os import path
 
 debug = False
 
+# Files are read and encoded this many bytes at a time
+CHUNK_SIZE = 1 << 16
+
+# Longest loop counter tried when building a delta with a loop
+LOOP_LIMIT = 16
+
+# Values the cells of CompactEncode are primed towards: digits, capitals,
+# lowercase letters and space
+PRIMES = (52, 77, 108, 32)
+
+
+def _loop(delta):
+    """Returns the cost and (count, step, rest) of the shortest loop on a
+    counter cell adding count * step + rest == delta to a cell"""
+    best = (abs(delta), None)
+    for count in range(2, LOOP_LIMIT + 1):
+        middle = int(round(delta / count))
+        for step in (middle - 1, middle, middle + 1):
+            if not step:
+                continue
+            rest = delta - count * step
+            # Brackets and the decrement of the counter
+            cost = count + abs(step) + abs(rest) + 3
+            if cost < best[0]:
+                best = (cost, (count, step, rest))
+    return best
+
+
+# Cheapest loop for each delta from -255 to 255, indexed by delta + 255.
+# Deltas are never wrapped, cells stay in 0-255 for languages without 8 bit
+# cells.
+LOOPS = [_loop(delta) for delta in range(-255, 256)]
+
+
+def _primer(primes):
+    """Returns code leaving cell 0 empty and the next cells set close to
+    primes with a single loop, and the values it sets"""
+    best = None
+    for count in range(2, LOOP_LIMIT + 1):
+        steps = [max(1, int(round(prime / count))) for prime in primes]
+        cost = count + sum(steps) + sum(abs(prime - count * step)
+                                        for prime, step in zip(primes, steps))
+        if best is None or cost < best[0]:
+            best = (cost, count, steps)
+    _, count, steps = best
+    code = "{}[{}{}-]".format("+" * count,
+                              "".join(">" + "+" * step for step in steps),
+                              "<" * len(steps))
+    return code, [0] + [count * step for step in steps]
+
+
+PRIMER, PRIMED = _primer(PRIMES)
+
 class Encode(object):
     """Text goes in, code comes out"""
     def __init__(self, speech):
         self.input = [ord(c) for c in speech]
         self.length = len(speech)
         self.output = []
+        # Where recode leaves the pointer and how many cells it uses
+        self.position = 0
+        self.cells = 1
 
     def _get_least(self, num):
         """Returns the minimum multiples of num"""
@@ -40,7 +98,10 @@ class Encode(object):
             append = mult[0] == 1 and mult[1] != 1
             if append:
                 mult = self._get_least(diff - 1)
-            if diff == 1:
+            if diff == 0:
+                # Only a leading NUL, the value cell is already right
+                self.output.append(">")
+            elif diff == 1:
                 if neg:
                     self.output.append(">-")
                 else:
@@ -62,18 +123,151 @@ class Encode(object):
                 self.output.append("{}\n".format(chr(self.input[index])))
         self.output = "".join(self.output)
         self.output = self.output[:self.output.rfind(".") + 1]
-        return self.output.replace("<>", "")
+        self.output = self.output.replace("<>", "")
+        if self.output:
+            self.position, self.cells = 1, 2
+        return self.output
+
+    def reset(self):
+        """Returns code clearing the cells recode used, leaving the pointer
+        on cell 0 as if the tape was new"""
+        if not self.output:
+            return ""
+        last = self.cells - 1
+        return ("<" if last < self.position else ">") * \
+            abs(last - self.position) + "[-]<" * last
+
+class CompactEncode(Encode):
+    """Text goes in, short code comes out.
+
+    Cell 0 counts loops, the cells after it are primed close to PRIMES. Each
+    character is printed from whichever cell is cheapest to move to and
+    change, with plain + and - or a loop on cell 0 from LOOPS. The shortest of
+    that, the same without priming and Encode's code is kept.
+    """
+    def _greedy(self, code, values):
+        """Returns code printing the input, starting from code that left
+        the cells holding values with the pointer on cell 0"""
+        output = [code]
+        values = list(values)
+        position = 0
+        for char in self.input:
+            choice = None
+            for cell in range(1, len(values)):
+                delta = char - values[cell]
+                cost = abs(delta)
+                if -255 <= delta <= 255:
+                    cost = min(cost, LOOPS[delta + 255][0] + 4 * cell)
+                cost += abs(position - cell)
+                if choice is None or cost < choice[0]:
+                    choice = (cost, cell, delta)
+            _, cell, delta = choice
+            output.append(("<" if cell < position else ">") *
+                          abs(position - cell))
+            output.append(self._change(cell, delta))
+            output.append(".")
+            values[cell], position = char, cell
+        return "".join(output), position, len(values)
+
+    @staticmethod
+    def _change(cell, delta):
+        """Returns code adding delta to cell, run and ending on cell"""
+        def plain(value):
+            return ("+" if value > 0 else "-") * abs(value)
+        if not -255 <= delta <= 255 or LOOPS[delta + 255][1] is None or \
+                abs(delta) <= LOOPS[delta + 255][0] + 4 * cell:
+            return plain(delta)
+        count, step, rest = LOOPS[delta + 255][1]
+        return "{0}{1}[{2}{3}{0}-]{2}{4}".format("<" * cell, "+" * count,
+                                                 ">" * cell, plain(step),
+                                                 plain(rest))
+
+    def recode(self):
+        simple = super().recode()
+        self.output, self.position, self.cells = min(
+            self._greedy("", [0, 0]), self._greedy(PRIMER, PRIMED),
+            (simple, self.position, self.cells),
+            key=lambda result: len(result[0]))
+        return self.output
+
+
+def _encode_chunk(Encoder, text):
+    """Encodes one chunk of text, returns its code and the reset after it"""
+    encoder = Encoder(text)
+    return encoder.recode(), encoder.reset()
+
+
+def encode_stream(source, target, Encoder=CompactEncode, size=CHUNK_SIZE,
+                  workers=1):
+    """Encodes the text of binary file source into code written to target.
+
+    Text is read and encoded size bytes at a time, so memory use doesn't
+    depend on the size of the input. Each chunk is encoded on its own from a
+    fresh tape, and the cells it used are cleared before the next one. With
+    workers above 1 chunks are encoded on a process pool, a few per worker
+    at a time, and written in order, giving the same code.
+    """
+    chunks = (chunk.decode(encoding="ASCII", errors="ignore")
+              for chunk in iter(lambda: source.read(size), b""))
+    reset = ""
+    for code, after in _encoded(chunks, Encoder, workers):
+        # Chunks without any text leave the tape as it was
+        if code:
+            target.write(reset)
+            target.write(code)
+            reset = after
+
+
+def _encoded(chunks, Encoder, workers):
+    """Yields (code, reset) for each chunk of text in order"""
+    if workers <= 1:
+        for chunk in chunks:
+            yield _encode_chunk(Encoder, chunk)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_encode_chunk, Encoder, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 if __name__ == "__main__":
-    if len(argv) == 1:
-        encoder = Encode(input("Text: "))
-        name = "out.b"
+    def get_arguments():
+        """Retrieves command line arguments"""
+        parser = argparse.ArgumentParser()
+        parser.add_argument("input",
+                            nargs="?",
+                            help="Text file to encode, asks for text if "
+                                 "left out")
+        parser.add_argument("-s", "--simple",
+                            action="store_true",
+                            help="Use the original single cell encoder")
+        parser.add_argument("-j", "--jobs",
+                            action="store",
+                            type=int,
+                            default=1,
+                            help="Worker processes encoding chunks of the "
+                                 "file in parallel, default 1")
+        parser.add_argument("--chunk-size",
+                            action="store",
+                            type=int,
+                            default=CHUNK_SIZE,
+                            help="Bytes of the file encoded at a time, "
+                                 "default {}".format(CHUNK_SIZE))
+        return parser.parse_args()
+
+
+    args = get_arguments()
+    Encoder = Encode if args.simple else CompactEncode
+    if args.input is None:
+        encoder = Encoder(input("Text: "))
+        with open("out.b", "w") as output_text:
+            output_text.write(encoder.recode())
     else:
-        with open(argv[1], "rb") as input_text:
-            text = input_text.read()
-        text = text.decode(encoding="ASCII", errors="ignore")
-        encoder = Encode(text)
-        name = path.splitext(path.split(argv[1])[-1])[0] + ".b"
-    out = encoder.recode()
-    with open(name, "w") as output_text:
-        output_text.write(out)
+        name = path.splitext(path.split(args.input)[-1])[0] + ".b"
+        with open(args.input, "rb") as input_text, \
+                open(name, "w") as output_text:
+            encode_stream(input_text, output_text, Encoder, args.chunk_size,
+                          args.jobs)